@@ -0,0 +1,100 @@
+import ChessEngine
+try:
+    import numpy as np
+except ImportError:  # only batch evaluation needs numpy, the engine does not
+    np = None
+
+# Scores many positions at once with NumPy. A position is encoded as 12
+# planes of 8x8 (one per piece in PIECES order, 1 where that piece stands),
+# N positions as an (N, 12, 8, 8) array. MG_WEIGHTS and EG_WEIGHTS hold the
+# same layout with piece value plus piece-square bonus of every piece on
+# every square, signed for the side, so the middle game and endgame scores
+# are one tensor contraction each. Tapered by the phase like the scalar
+# evaluation they equal ChessEngine.evaluateBoard exactly.
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+MATE_SCORE = 10000
+
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("batch evaluation needs numpy")
+
+
+def buildWeights(squareScores):
+    # (12, 8, 8) score of each piece on each square from white's view out
+    # of ChessEngine.MG_SCORES or EG_SCORES
+    requireNumpy()
+    return np.array([squareScores[piece] for piece in PIECES], dtype=np.int64)
+
+
+MG_WEIGHTS = buildWeights(ChessEngine.MG_SCORES) if np is not None else None
+EG_WEIGHTS = buildWeights(ChessEngine.EG_SCORES) if np is not None else None
+PHASE_WEIGHTS = np.array([ChessEngine.PHASE_WEIGHTS.get(piece[1], 0) for piece in PIECES],
+                         dtype=np.int64) if np is not None else None
+
+
+def buildCodeTable():
+    # plane index of a piece by its two characters, -1 for "--"
+    table = np.full((256, 256), -1, dtype=np.int8)
+    for piece, i in PIECE_INDEX.items():
+        table[ord(piece[0]), ord(piece[1])] = i
+    return table
+
+
+CODE_TABLE = buildCodeTable() if np is not None else None
+
+
+def encodeBoards(boards):
+    # (N, 12, 8, 8) uint8 planes of N boards in the GameState.board layout.
+    # The boards are joined into one string and decoded two bytes a square.
+    requireNumpy()
+    text = "".join(["".join(row) for board in boards for row in board]).encode("ascii")
+    squares = np.frombuffer(text, dtype=np.uint8).reshape(-1, 1, 8, 8, 2)
+    codes = CODE_TABLE[squares[..., 0], squares[..., 1]]
+    return (codes == np.arange(12, dtype=np.int8).reshape(1, 12, 1, 1)).astype(np.uint8)
+
+
+def encodeBitboards(gameStates):
+    # same planes straight from BitboardGameState bitboards, bit row*8 + col
+    requireNumpy()
+    words = np.array([[gs.bitboards[piece] for piece in PIECES] for gs in gameStates],
+                     dtype="<u8").reshape(-1, 12)
+    bits = np.unpackbits(words.view(np.uint8).reshape(-1, 12, 8), axis=2, bitorder="little")
+    return bits.reshape(-1, 12, 8, 8)
+
+
+def encodePositions(gameStates):
+    gameStates = list(gameStates)
+    if gameStates and all(hasattr(gs, "bitboards") for gs in gameStates):
+        return encodeBitboards(gameStates)
+    return encodeBoards([gs.board for gs in gameStates])
+
+
+def evaluatePlanes(planes):
+    # (N,) tapered material and piece-square scores from white's view
+    requireNumpy()
+    planes = planes.astype(np.int64)
+    mg = np.tensordot(planes, MG_WEIGHTS, axes=([1, 2, 3], [0, 1, 2]))
+    eg = np.tensordot(planes, EG_WEIGHTS, axes=([1, 2, 3], [0, 1, 2]))
+    phase = np.minimum(planes.sum(axis=(2, 3)) @ PHASE_WEIGHTS, ChessEngine.MAX_PHASE)
+    return (mg*phase + eg*(ChessEngine.MAX_PHASE - phase)) // ChessEngine.MAX_PHASE
+
+
+def evaluateBoards(boards):
+    # ChessEngine.evaluateBoard of every board
+    return evaluatePlanes(encodeBoards(boards))
+
+
+def evaluatePositions(gameStates):
+    # ChessAI.evaluate of every game state: from the side to move's view,
+    # -MATE_SCORE when checkmated and 0 when stalemated by the flags the last
+    # getValidMove call left behind
+    gameStates = list(gameStates)
+    scores = evaluatePlanes(encodePositions(gameStates))
+    toMove = np.array([1 if gs.whiteToMove else -1 for gs in gameStates], dtype=np.int64)
+    scores = scores * toMove
+    mated = np.array([gs.checkMate for gs in gameStates], dtype=bool)
+    drawn = np.array([gs.staleMate for gs in gameStates], dtype=bool)
+    return np.where(mated, -MATE_SCORE, np.where(drawn, 0, scores))
@@ -0,0 +1,487 @@
+import ChessEngine
+from ChessEngine import Move
+
+# Bitboard position backend. Every piece ("wP", "bK", ...) is a 64 bit int
+# where bit row*8+col is set when that piece stands on (row, col). Row 0 is
+# the 8th rank, the same way round as GameState.board.
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK")
+FULL = (1 << 64) - 1
+
+# ray directions, 0-3 orthogonal and 4-7 diagonal like checkForPinsAndChecks
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1))
+# directions walking towards higher square numbers, their first blocker is
+# the lowest set bit instead of the highest
+POSITIVE = (False, False, True, True, False, False, True, True)
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+
+
+def inside(row, col):
+    return 0 <= row <= 7 and 0 <= col <= 7
+
+
+def jumpTable(jumps):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        for d in jumps:
+            if inside(row + d[0], col + d[1]):
+                bb |= 1 << ((row + d[0])*8 + col + d[1])
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = jumpTable(((-2, -1), (-2, 1), (2, -1), (2, 1),
+                            (-1, -2), (-1, 2), (1, -2), (1, 2)))
+KING_ATTACKS = jumpTable(DIRECTIONS)
+# squares a pawn of that colour standing on sq attacks
+PAWN_ATTACKS = {"w": jumpTable(((-1, -1), (-1, 1))),
+                "b": jumpTable(((1, -1), (1, 1)))}
+
+def rayTables():
+    # RAYS[sq][d] is every square from sq towards d, BETWEEN[a][b] the squares
+    # strictly between two squares on a common line (0 when not aligned)
+    rays = []
+    between = [[0]*64 for _ in range(64)]
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        sqRays = []
+        for d in DIRECTIONS:
+            ray = 0
+            for i in range(1, 8):
+                next_row = row + d[0]*i
+                next_col = col + d[1]*i
+                if not inside(next_row, next_col):
+                    break
+                target = next_row*8 + next_col
+                between[sq][target] = ray
+                ray |= 1 << target
+            sqRays.append(ray)
+        rays.append(sqRays)
+    return rays, between
+
+
+RAYS, BETWEEN = rayTables()
+# every square a rook or bishop on sq could reach on an empty board
+ROOK_RAYS = [RAYS[sq][0] | RAYS[sq][1] | RAYS[sq][2] | RAYS[sq][3] for sq in range(64)]
+BISHOP_RAYS = [RAYS[sq][4] | RAYS[sq][5] | RAYS[sq][6] | RAYS[sq][7] for sq in range(64)]
+
+
+def lsb(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def squares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def rayAttacks(sq, d, occ):
+    # every square along the ray up to and including the first blocker
+    ray = RAYS[sq][d]
+    blockers = ray & occ
+    if blockers:
+        if POSITIVE[d]:
+            first = (blockers & -blockers).bit_length() - 1
+        else:
+            first = blockers.bit_length() - 1
+        ray ^= RAYS[first][d]
+    return ray
+
+
+def lineTables(first, second):
+    # per square (mask, table) of the line through it along two opposite
+    # directions: table[occ & mask] is every square the line attacks. The
+    # last square of each ray never blocks anything, so it is left out of
+    # the mask, keeping every table at 64 entries or fewer.
+    lines = []
+    for sq in range(64):
+        mask = 0
+        for d in (first, second):
+            for target in squares(RAYS[sq][d]):
+                if RAYS[target][d]:
+                    mask |= 1 << target
+        table = {}
+        occ = 0
+        while True:
+            table[occ] = rayAttacks(sq, first, occ) | rayAttacks(sq, second, occ)
+            occ = (occ - mask) & mask
+            if not occ:
+                break
+        lines.append((mask, table))
+    return lines
+
+
+# ranks, files, diagonals and anti-diagonals, looked up instead of walking
+# four rays per slider
+RANK_LINES = lineTables(1, 3)
+FILE_LINES = lineTables(0, 2)
+DIAGONAL_LINES = lineTables(4, 7)
+ANTI_DIAGONAL_LINES = lineTables(5, 6)
+ROOK_LINES = tuple(zip(RANK_LINES, FILE_LINES))
+BISHOP_LINES = tuple(zip(DIAGONAL_LINES, ANTI_DIAGONAL_LINES))
+
+
+def rookAttacks(sq, occ):
+    (rankMask, rank), (fileMask, file) = ROOK_LINES[sq]
+    return rank[occ & rankMask] | file[occ & fileMask]
+
+
+def bishopAttacks(sq, occ):
+    (diagonalMask, diagonal), (antiMask, anti) = BISHOP_LINES[sq]
+    return diagonal[occ & diagonalMask] | anti[occ & antiMask]
+
+
+class BitboardGameState(ChessEngine.GameState):
+    def __init__(self):
+        self.bitboards = dict.fromkeys(PIECES, 0)
+        self.occupancy = {"w": 0, "b": 0}
+        # mailbox copy of the position kept in step with the bitboards, so
+        # Move() and .board read the pieces without rebuilding anything
+        self.mailbox = [["--"]*8 for _ in range(8)]
+        super().__init__()
+
+    @property
+    def board(self):
+        # the mailbox itself, read only: a square written through it does
+        # not reach the bitboards, move pieces with putPiece/removePiece
+        return self.mailbox
+
+    @board.setter
+    def board(self, board):
+        self.bitboards = dict.fromkeys(PIECES, 0)
+        self.occupancy = {"w": 0, "b": 0}
+        self.mailbox = [["--"]*8 for _ in range(8)]
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] != "--":
+                    self.putPiece(board[row][col], row, col)
+
+    def putPiece(self, piece, row, col):
+        bit = 1 << (row*8 + col)
+        self.bitboards[piece] |= bit
+        self.occupancy[piece[0]] |= bit
+        self.mailbox[row][col] = piece
+
+    def removePiece(self, piece, row, col):
+        bit = 1 << (row*8 + col)
+        self.bitboards[piece] ^= bit
+        self.occupancy[piece[0]] ^= bit
+        self.mailbox[row][col] = "--"
+
+    def makeMove(self, move):
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.zobristLog.append(self.zobristKey)
+        self.updateClocks(move)
+        self.removePiece(move.pieceMoved, move.startRow, move.startCol)
+        if move.isEnpassantMove:
+            self.removePiece(move.pieceCaptured, move.startRow, move.endCol)
+        elif move.pieceCaptured != "--":
+            self.removePiece(move.pieceCaptured, move.endRow, move.endCol)
+        if move.isPawnPromotion:
+            self.putPiece(move.pieceMoved[0] + move.promotionChoice,
+                          move.endRow, move.endCol)
+        else:
+            self.putPiece(move.pieceMoved, move.endRow, move.endCol)
+        self.moveLog.append(move)
+        self.whiteToMove = not self.whiteToMove
+        if move.pieceMoved == "wK":
+            self.whiteKingLocation = (move.endRow, move.endCol)
+        elif move.pieceMoved == "bK":
+            self.blackKingLocation = (move.endRow, move.endCol)
+        if move.pieceMoved[1] == "P" and abs(move.startRow-move.endRow) == 2:
+            self.enpassantPossible = (
+                (move.startRow+move.endRow)//2, move.startCol)
+        else:
+            self.enpassantPossible = ()
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + "R"
+            if move.endCol - move.startCol == 2:
+                self.removePiece(rook, move.endRow, move.endCol+1)
+                self.putPiece(rook, move.endRow, move.endCol-1)
+            else:
+                self.removePiece(rook, move.endRow, move.endCol-2)
+                self.putPiece(rook, move.endRow, move.endCol+1)
+        self.updateCastleRights(move)
+        self.castlingRightsLog.append(ChessEngine.CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
+                                                               self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+        mg, eg, phase = ChessEngine.moveDelta(move)
+        self.mgScore += mg
+        self.egScore += eg
+        self.phase += phase
+        self.updateZobristKey(move)
+        if self.zobristDebug:
+            self.checkZobristKey()
+
+    def undoMove(self):
+        if len(self.moveLog) > 0:
+            last_move = self.moveLog.pop()
+            if last_move.isPawnPromotion:
+                self.removePiece(last_move.pieceMoved[0] + last_move.promotionChoice,
+                                 last_move.endRow, last_move.endCol)
+            else:
+                self.removePiece(last_move.pieceMoved,
+                                 last_move.endRow, last_move.endCol)
+            self.putPiece(last_move.pieceMoved,
+                          last_move.startRow, last_move.startCol)
+            if last_move.isEnpassantMove:
+                self.putPiece(last_move.pieceCaptured,
+                              last_move.startRow, last_move.endCol)
+            elif last_move.pieceCaptured != "--":
+                self.putPiece(last_move.pieceCaptured,
+                              last_move.endRow, last_move.endCol)
+            self.whiteToMove = not self.whiteToMove
+            self.undoClocks()
+            if last_move.pieceMoved == "wK":
+                self.whiteKingLocation = (
+                    last_move.startRow, last_move.startCol)
+            elif last_move.pieceMoved == "bK":
+                self.blackKingLocation = (
+                    last_move.startRow, last_move.startCol)
+            self.enpassantPossible = self.enpassantPossibleLog.pop()
+            self.zobristKey = self.zobristLog.pop()
+            self.castlingRightsLog.pop()
+            newRights = self.castlingRightsLog[-1]
+            self.currentCastlingRights = ChessEngine.CastleRights(
+                newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
+            if last_move.isCastleMove:
+                rook = last_move.pieceMoved[0] + "R"
+                if last_move.endCol - last_move.startCol == 2:
+                    self.removePiece(rook, last_move.endRow, last_move.endCol-1)
+                    self.putPiece(rook, last_move.endRow, last_move.endCol+1)
+                else:
+                    self.removePiece(rook, last_move.endRow, last_move.endCol+1)
+                    self.putPiece(rook, last_move.endRow, last_move.endCol-2)
+            mg, eg, phase = ChessEngine.moveDelta(last_move)
+            self.mgScore -= mg
+            self.egScore -= eg
+            self.phase -= phase
+            if self.zobristDebug:
+                self.checkZobristKey()
+
+    def attackersTo(self, sq, color, occ):
+        # pieces of colour `color` attacking sq, with occ as the blockers
+        bb = self.bitboards
+        other = "b" if color == "w" else "w"
+        attackers = (KNIGHT_ATTACKS[sq] & bb[color + "N"]) | \
+            (KING_ATTACKS[sq] & bb[color + "K"]) | \
+            (PAWN_ATTACKS[other][sq] & bb[color + "P"])
+        # sliders only when one stands on a line through sq
+        rookLike = bb[color + "R"] | bb[color + "Q"]
+        if rookLike & ROOK_RAYS[sq]:
+            attackers |= rookAttacks(sq, occ) & rookLike
+        bishopLike = bb[color + "B"] | bb[color + "Q"]
+        if bishopLike & BISHOP_RAYS[sq]:
+            attackers |= bishopAttacks(sq, occ) & bishopLike
+        return attackers
+
+    def hasNonPawnMaterial(self):
+        allyColor = "w" if self.whiteToMove else "b"
+        bb = self.bitboards
+        return (bb[allyColor + "N"] | bb[allyColor + "B"] | bb[allyColor + "R"] | bb[allyColor + "Q"]) != 0
+
+    def pieceCount(self):
+        return bin(self.occupancy["w"] | self.occupancy["b"]).count("1")
+
+    def squareAttackedBy(self, row, col, enemyColor):
+        occ = self.occupancy["w"] | self.occupancy["b"]
+        return self.attackersTo(row*8 + col, enemyColor, occ) != 0
+
+    def squareUnderAttack(self, row, col):
+        enemyColor = "b" if self.whiteToMove else "w"
+        occ = self.occupancy["w"] | self.occupancy["b"]
+        return self.attackersTo(row*8 + col, enemyColor, occ) != 0
+
+    def inCheck(self):
+        if self.whiteToMove:
+            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
+        return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+
+    def getPins(self, kingSq, allyColor, enemyColor, occ):
+        # {square: line mask} for every ally piece pinned to its king
+        bb = self.bitboards
+        own = self.occupancy[allyColor]
+        rookLike = bb[enemyColor + "R"] | bb[enemyColor + "Q"]
+        bishopLike = bb[enemyColor + "B"] | bb[enemyColor + "Q"]
+        pins = {}
+        for d in range(8):
+            sliders = rookLike if d < 4 else bishopLike
+            if not RAYS[kingSq][d] & sliders:
+                continue
+            blockers = RAYS[kingSq][d] & occ
+            if not blockers & own:
+                continue
+            if POSITIVE[d]:
+                first = lsb(blockers)
+                blockers ^= 1 << first
+                if not blockers:
+                    continue
+                second = lsb(blockers)
+            else:
+                first = blockers.bit_length() - 1
+                blockers ^= 1 << first
+                if not blockers:
+                    continue
+                second = blockers.bit_length() - 1
+            if (own >> first) & 1 and (sliders >> second) & 1:
+                pins[first] = BETWEEN[kingSq][second] | (1 << second)
+        return pins
+
+    def getValidMove(self):
+        moves = self.generateLegalMoves()
+        if len(moves) == 0:
+            if self.inCheck():
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
+
+    def getCaptureMoves(self):
+        # legal already, the masks below leave nothing for isLegalMove to do
+        return self.generateLegalMoves(quiets=False)
+
+    def getQuietMoves(self):
+        return self.generateLegalMoves(captures=False)
+
+    def isLegalMove(self, move):
+        return True
+
+    def getMoveByID(self, moveID):
+        start = (moveID // 1000) * 8 + (moveID // 100) % 10
+        for move in self.generateLegalMoves(fromMask=1 << start):
+            if move.moveID == moveID and not move.isCastleMove:
+                return move
+        return None
+
+    def generateLegalMoves(self, captures=True, quiets=True, fromMask=FULL):
+        # captures covers promotions and en passant, quiets everything else
+        # including castling. fromMask limits the squares moved from.
+        allyColor = "w" if self.whiteToMove else "b"
+        enemyColor = "b" if self.whiteToMove else "w"
+        bb = self.bitboards
+        own = self.occupancy[allyColor]
+        enemy = self.occupancy[enemyColor]
+        occ = own | enemy
+        kingSq = lsb(bb[allyColor + "K"])
+        kingRow, kingCol = kingSq >> 3, kingSq & 7
+        checkers = self.attackersTo(kingSq, enemyColor, occ)
+        board = self.mailbox
+        moves = []
+        targetSelect = 0
+        if captures:
+            targetSelect |= enemy
+        if quiets:
+            targetSelect |= ~occ & FULL
+
+        # king moves, tested with the king lifted off its square
+        if (fromMask >> kingSq) & 1:
+            occNoKing = occ ^ (1 << kingSq)
+            targets = KING_ATTACKS[kingSq] & targetSelect
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                target = low.bit_length() - 1
+                if not self.attackersTo(target, enemyColor, occNoKing):
+                    moves.append(
+                        Move((kingRow, kingCol), (target >> 3, target & 7), board))
+
+        if checkers & (checkers - 1) == 0:
+            if checkers:
+                checkMask = checkers | BETWEEN[kingSq][lsb(checkers)]
+            else:
+                checkMask = FULL
+            pins = self.getPins(kingSq, allyColor, enemyColor, occ)
+            targetMask = targetSelect & checkMask
+
+            # bit loops written out, a generator per piece costs more than
+            # the lookups
+            for piece in ("N", "B", "R", "Q"):
+                starts = bb[allyColor + piece] & fromMask
+                while starts:
+                    low = starts & -starts
+                    starts ^= low
+                    start = low.bit_length() - 1
+                    if piece == "N":
+                        if start in pins:
+                            continue
+                        targets = KNIGHT_ATTACKS[start]
+                    elif piece == "B":
+                        targets = bishopAttacks(start, occ)
+                    elif piece == "R":
+                        targets = rookAttacks(start, occ)
+                    else:
+                        targets = rookAttacks(start, occ) | bishopAttacks(start, occ)
+                    targets &= targetMask
+                    if start in pins:
+                        targets &= pins[start]
+                    startSquare = (start >> 3, start & 7)
+                    while targets:
+                        low = targets & -targets
+                        targets ^= low
+                        target = low.bit_length() - 1
+                        moves.append(Move(startSquare, (target >> 3, target & 7), board))
+
+            self.getBitboardPawnMoves(allyColor, enemyColor, kingSq, occ, checkMask,
+                                      pins, moves, captures, quiets, fromMask)
+            if quiets and not checkers and (fromMask >> kingSq) & 1:
+                self.getBitboardCastleMoves(kingSq, enemyColor, occ, moves)
+        return moves
+
+    def getBitboardPawnMoves(self, allyColor, enemyColor, kingSq, occ, checkMask, pins, moves,
+                             captures=True, quiets=True, fromMask=FULL):
+        board = self.mailbox
+        enemy = self.occupancy[enemyColor]
+        step = -8 if allyColor == "w" else 8
+        startRow = 6 if allyColor == "w" else 1
+        promotionRow = 1 if allyColor == "w" else 6
+        if self.enpassantPossible and captures:
+            epSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1]
+        else:
+            epSq = -1
+        for start in squares(self.bitboards[allyColor + "P"] & fromMask):
+            row, col = start >> 3, start & 7
+            allowed = checkMask
+            if start in pins:
+                allowed &= pins[start]
+            # pushes onto the last rank are promotions and count as captures
+            pushes = captures if row == promotionRow else quiets
+            one = start + step
+            if pushes and not (occ >> one) & 1:
+                if (allowed >> one) & 1:
+                    moves.append(Move((row, col), (one >> 3, one & 7), board))
+                two = one + step
+                if row == startRow and not (occ >> two) & 1 and (allowed >> two) & 1:
+                    moves.append(Move((row, col), (two >> 3, two & 7), board))
+            if not captures:
+                continue
+            for target in squares(PAWN_ATTACKS[allyColor][start] & enemy & allowed):
+                moves.append(Move((row, col), (target >> 3, target & 7), board))
+            if epSq >= 0 and (PAWN_ATTACKS[allyColor][start] >> epSq) & 1:
+                # two pawns leave one rank, so check the king directly
+                captured = (row << 3) | (epSq & 7)
+                after = occ ^ (1 << start) ^ (1 << epSq) ^ (1 << captured)
+                if not self.attackersTo(kingSq, enemyColor, after) & ~(1 << captured):
+                    moves.append(Move((row, col), (epSq >> 3, epSq & 7),
+                                      board, isEnpassantMove=True))
+
+    def getBitboardCastleMoves(self, kingSq, enemyColor, occ, moves):
+        row, col = kingSq >> 3, kingSq & 7
+        if (self.whiteToMove and self.currentCastlingRights.wks) or (not self.whiteToMove and self.currentCastlingRights.bks):
+            if not (occ >> (kingSq+1)) & 1 and not (occ >> (kingSq+2)) & 1 and \
+                    not self.attackersTo(kingSq+1, enemyColor, occ) and not self.attackersTo(kingSq+2, enemyColor, occ):
+                moves.append(Move((row, col), (row, col+2),
+                                  self.mailbox, isCastleMove=True))
+        if (self.whiteToMove and self.currentCastlingRights.wqs) or (not self.whiteToMove and self.currentCastlingRights.bqs):
+            if not (occ >> (kingSq-1)) & 1 and not (occ >> (kingSq-2)) & 1 and not (occ >> (kingSq-3)) & 1 and \
+                    not self.attackersTo(kingSq-1, enemyColor, occ) and not self.attackersTo(kingSq-2, enemyColor, occ):
+                moves.append(Move((row, col), (row, col-2),
+                                  self.mailbox, isCastleMove=True))
@@ -0,0 +1,595 @@
+import copy
+import os
+import threading
+import time
+import ChessEngine
+import TranspositionTable
+import MovePicker
+import MoveOrdering
+import OpeningBook
+import SearchStats
+import Tablebase
+# the engine side of the game: evaluation, search and its settings. Nothing
+# here needs pygame, ChessMain draws the board and Uci.py talks UCI.
+TT_SIZE_MB = 16
+transpositionTable = TranspositionTable.TranspositionTable(TT_SIZE_MB)
+# opening book, built from openings.txt. Next to this file, so the UCI
+# engine and match workers find it whatever directory they start in.
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+openingBook = None  # opened on first use
+# endgame tablebases from Tablebase.py, probed once few enough pieces are
+# left. Their distance to mate makes a tablebase win an ordinary mate score.
+TABLEBASE_DIR = Tablebase.TABLEBASE_DIR
+tablebases = None  # loaded on first use
+MAX_SEARCH_DEPTH = 64
+# being mated scores -MATE_SCORE plus the plies from the root, so a quicker
+# mate scores higher. Anything past MATE_THRESHOLD is a mate score, the
+# transposition table keeps them relative to the node they were found at.
+MATE_SCORE = 10000
+MATE_THRESHOLD = MATE_SCORE - MoveOrdering.MAX_PLY
+# "negamax" searches every move with the full window, "pvs" (principal
+# variation search) only the first and the rest with a null window
+SEARCH_ALGORITHM = "negamax"
+ASPIRATION_WINDOW = 50
+# null move pruning: give the opponent a free move at reduced depth and
+# prune when that still fails high
+NULL_MOVE_PRUNING = True
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# late move reductions: quiet moves after the first few are searched
+# LMR_REDUCTION plies shallower and again at full depth if they beat alpha
+LATE_MOVE_REDUCTIONS = True
+LMR_FULL_DEPTH_MOVES = 3
+LMR_MIN_DEPTH = 3
+LMR_REDUCTION = 1
+QSEARCH_DEPTH = 8  # plies of captures searched past the horizon
+QSEARCH_DELTA_MARGIN = 200
+lastSearch = None  # SearchControl of the latest search, holds its node counts
+# SearchStats of every search in control.stats, and appended as a JSON line
+# to STATS_FILE when that is set. Off the search only skips a few None checks.
+SEARCH_STATS = False
+STATS_FILE = None
+
+
+def evaluate(gs):
+    # score from the side to move's point of view, the mate and stalemate
+    # flags are the ones the last getValidMove call on gs left behind
+    if gs.checkMate:
+        return -MATE_SCORE
+    if gs.staleMate:
+        return 0
+    score = gs.boardscore
+    if gs.whiteToMove:
+        return score
+    else:
+        return -score
+
+
+def staticEval(gs):
+    # evaluation without the mate and stalemate checks, for quiet positions
+    return gs.boardscore if gs.whiteToMove else -gs.boardscore
+
+
+def orderMoves(moves, hashMoveID=None, ordering=None, ply=0):
+    moves.sort(key=ChessEngine.evalmove, reverse=True)
+    if ordering is not None:
+        moves.sort(key=lambda move: ordering.scoreMove(move, ply), reverse=True)
+    if hashMoveID is not None:
+        for i in range(len(moves)):
+            if moves[i].moveID == hashMoveID:
+                moves.insert(0, moves.pop(i))
+                break
+
+
+class SearchControl():
+    # time and node budget of one search, nodes check the clock every
+    # CHECK_EVERY nodes and unwind once stopped is set. nodes counts every
+    # node visited, qnodes the quiescence search share of them.
+    CHECK_EVERY = 1024
+
+    def __init__(self, timeLimit=None, nodeLimit=None, algorithm=None):
+        self.algorithm = algorithm or SEARCH_ALGORITHM
+        self.startTime = time.perf_counter()
+        self.deadline = None if timeLimit is None else self.startTime + timeLimit
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.qnodes = 0
+        self.stopped = False
+        # killers and history shared by every iteration of the search, and
+        # the zobristLog length at the root to tell the ply of a node, it
+        # grows with null moves too
+        self.ordering = MoveOrdering.MoveOrdering()
+        self.rootPly = 0
+        self.nullMove = NULL_MOVE_PRUNING
+        self.completedDepth = 0
+        self.lateMoveReductions = LATE_MOVE_REDUCTIONS
+        self.tablebases = loadTablebases()
+        self.stats = SearchStats.SearchStats() if SEARCH_STATS else None
+
+    def tick(self):
+        self.nodes += 1
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+        elif self.deadline is not None and self.nodes % self.CHECK_EVERY == 0 and \
+                time.perf_counter() >= self.deadline:
+            self.stopped = True
+        return self.stopped
+
+
+def scoreToTable(score, ply):
+    # mate scores as seen from the node instead of the root
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def minimaxalphabeta(gs, alpha, beta, depth, tt=None, control=None, allowNull=True):
+    if(depth == 0):
+        return qsearch(gs, alpha, beta, QSEARCH_DEPTH, control)
+    if control is not None and (control.stopped or control.tick()):
+        return 0
+    ply = len(gs.zobristLog) - control.rootPly if control is not None else 0
+    if control is not None and control.tablebases is not None and \
+            gs.pieceCount() <= control.tablebases.maxPieces:
+        result = control.tablebases.probe(gs)
+        if result is not None:
+            # mate after plies more, scored like a mate found by the search
+            value, plies = result
+            return value * (MATE_SCORE - ply - plies)
+    hashMoveID = None
+    if tt is not None:
+        key = gs.zobristKey
+        entry = tt.probe(key)
+        if entry is not None:
+            entryDepth, entryScore, bound, hashMoveID = entry
+            entryScore = scoreFromTable(entryScore, ply)
+            if entryDepth >= depth:
+                if bound == TranspositionTable.EXACT:
+                    return entryScore
+                if bound == TranspositionTable.LOWERBOUND and entryScore >= beta:
+                    return entryScore
+                if bound == TranspositionTable.UPPERBOUND and entryScore <= alpha:
+                    return entryScore
+    inCheck = False
+    if control is not None and depth >= min(NULL_MOVE_MIN_DEPTH, LMR_MIN_DEPTH):
+        inCheck = gs.inCheck()
+        # null move pruning, not in check, not twice in a row, not near a
+        # mate score and not without pieces where zugzwang is common
+        if control.nullMove and allowNull and depth >= NULL_MOVE_MIN_DEPTH and not inCheck and \
+                beta < MATE_THRESHOLD and gs.hasNonPawnMaterial():
+            gs.makeNullMove()
+            score = -minimaxalphabeta(gs, -beta, -beta+1, max(0, depth-1-NULL_MOVE_REDUCTION),
+                                      tt, control, False)
+            gs.undoNullMove()
+            if control.stopped:
+                return 0
+            if score >= beta:
+                return beta
+    alphaOrig = alpha
+    maxscore = -MATE_SCORE
+    bestMoveID = None
+    moveCount = 0
+    ordering = None
+    reduceLate = False
+    if control is not None:
+        ordering = control.ordering
+        if control.stats is not None:
+            control.stats.reach(ply)
+        reduceLate = control.lateMoveReductions and depth >= LMR_MIN_DEPTH and not inCheck
+    for move in MovePicker.pickMoves(gs, hashMoveID, ordering, ply):
+        moveCount += 1
+        if move.isPawnPromotion:
+            move.promotionChoice = 'Q'
+        gs.makeMove(move)
+        if reduceLate and moveCount > LMR_FULL_DEPTH_MOVES and MoveOrdering.isQuiet(move) and \
+                not gs.inCheck():
+            # late quiet move, a reduced null window search that stays at or
+            # below alpha is trusted and the full search skipped
+            score = -minimaxalphabeta(gs, -alpha-1, -alpha, depth-1-LMR_REDUCTION,
+                                      tt, control)
+            if score <= alpha or control.stopped:
+                gs.undoMove()
+                if control.stopped:
+                    return 0
+                if score > maxscore:
+                    maxscore = score
+                    bestMoveID = move.moveID
+                continue
+        if moveCount > 1 and control is not None and control.algorithm == "pvs":
+            # prove the move is no better than alpha with a null window and
+            # only search it properly when that fails high
+            score = -minimaxalphabeta(gs, -alpha-1, -alpha,
+                                      depth-1, tt, control)
+            if alpha < score < beta:
+                score = -minimaxalphabeta(gs, -beta, -alpha,
+                                          depth-1, tt, control)
+        else:
+            score = -minimaxalphabeta(gs, -beta, -alpha, depth-1, tt, control)
+        gs.undoMove()
+        if control is not None and control.stopped:
+            return 0
+        if(score >= beta):
+            if ordering is not None:
+                ordering.recordCutoff(move, ply, depth)
+            if control is not None and control.stats is not None:
+                control.stats.cutoff(moveCount)
+            if tt is not None:
+                tt.store(key, depth, scoreToTable(score, ply),
+                         TranspositionTable.LOWERBOUND, move.moveID)
+            return score
+        if(score > maxscore):
+            maxscore = score
+            bestMoveID = move.moveID
+        if(score > alpha):
+            alpha = score
+    if moveCount == 0:
+        # checkmate or stalemate
+        maxscore = -MATE_SCORE + ply if gs.inCheck() else 0
+    if tt is not None:
+        bound = TranspositionTable.EXACT if maxscore > alphaOrig else TranspositionTable.UPPERBOUND
+        tt.store(key, depth, scoreToTable(maxscore, ply), bound, bestMoveID)
+    return maxscore
+
+
+def resolveTable(tt):
+    # None means the module table, False searching without one
+    if tt is None:
+        return transpositionTable
+    if tt is False:
+        return None
+    return tt
+
+
+def loadTablebases():
+    # the tables in TABLEBASE_DIR, None if there are none
+    global tablebases
+    if tablebases is None:
+        tablebases = Tablebase.Tablebases(TABLEBASE_DIR)
+    return tablebases if tablebases.maxPieces else None
+
+
+def resolveBook(book):
+    # None means the module book if BOOK_FILE exists, False no book
+    global openingBook
+    if book is None:
+        if openingBook is None and os.path.exists(BOOK_FILE):
+            openingBook = OpeningBook.OpeningBook(BOOK_FILE)
+        return openingBook
+    if book is False:
+        return None
+    return book
+
+
+def principalVariation(gs, tt, maxLength=MAX_SEARCH_DEPTH):
+    # the line the table expects from gs, following stored best moves as
+    # long as they are legal and the position does not repeat
+    pv = []
+    seen = set()
+    while tt is not None and len(pv) < maxLength and gs.zobristKey not in seen:
+        seen.add(gs.zobristKey)
+        entry = tt.probe(gs.zobristKey)
+        if entry is None or entry[3] is None:
+            break
+        move = gs.getMoveByID(entry[3])
+        if move is None or not gs.isLegalMove(move):
+            break
+        if move.isPawnPromotion:
+            move.promotionChoice = 'Q'
+        gs.makeMove(move)
+        pv.append(move)
+    for move in pv:
+        gs.undoMove()
+    return pv
+
+
+def searchRoot(gs, depth, tt=None, control=None, firstMoveID=None, alpha=-100000, beta=100000):
+    # (best move, score), the move is None if control stopped the search
+    # before every root move was searched. A score <= alpha or >= beta
+    # only bounds the real one.
+    machmove = None
+    maxval = -99999
+    alphaOrig = alpha
+    hashMoveID = firstMoveID
+    if tt is not None:
+        key = gs.zobristKey
+        entry = tt.probe(key)
+        if entry is not None and hashMoveID is None:
+            hashMoveID = entry[3]
+    moves = gs.getValidMove()
+    usePvs = False
+    if control is not None:
+        control.rootPly = len(gs.zobristLog)
+        orderMoves(moves, hashMoveID, control.ordering)
+        usePvs = control.algorithm == "pvs"
+    else:
+        orderMoves(moves, hashMoveID)
+    for move in moves:
+        if move.isPawnPromotion:
+            move.promotionChoice = 'Q'
+        gs.makeMove(move)
+        if usePvs and machmove is not None:
+            val = -minimaxalphabeta(gs, -alpha-1, -alpha,
+                                    depth-1, tt, control)
+            if alpha < val < beta:
+                val = -minimaxalphabeta(gs, -beta, -alpha,
+                                        depth-1, tt, control)
+        else:
+            val = -minimaxalphabeta(gs, -beta, -alpha, depth-1, tt, control)
+        gs.undoMove()
+        if control is not None and control.stopped:
+            return None, maxval
+        if(val > maxval):
+            maxval = val
+            machmove = move
+        if(val > alpha):
+            alpha = val
+        if(val >= beta):
+            break
+    if tt is not None and machmove is not None:
+        if maxval >= beta:
+            bound = TranspositionTable.LOWERBOUND
+        elif maxval <= alphaOrig:
+            bound = TranspositionTable.UPPERBOUND
+        else:
+            bound = TranspositionTable.EXACT
+        tt.store(key, depth, maxval, bound, machmove.moveID)
+    return machmove, maxval
+
+
+def aimove(gs, depth, tt=None, algorithm=None, book=None):
+    # algorithm is "negamax" or "pvs", None picks SEARCH_ALGORITHM. A move
+    # from the opening book is played without searching.
+    global lastSearch
+    book = resolveBook(book)
+    if book is not None:
+        move = book.chooseMove(gs)
+        if move is not None:
+            return move
+    tt = resolveTable(tt)
+    if tt is not None:
+        tt.newSearch()
+    lastSearch = SearchControl(algorithm=algorithm)
+    stats = lastSearch.stats
+    if stats is None:
+        move, score = searchRoot(gs, depth, tt, lastSearch)
+    else:
+        stats.attach(gs, tt)
+        try:
+            move, score = searchRoot(gs, depth, tt, lastSearch)
+        finally:
+            stats.detach(gs)
+    lastSearch.completedDepth = depth
+    if stats is not None:
+        stats.iteration(lastSearch, depth, score, principalVariation(gs, tt, depth) or [move])
+        finishStats(lastSearch, tt, move)
+    return move
+
+
+def finishStats(control, tt, move):
+    record = control.stats.finish(control, tt, move)
+    if STATS_FILE is not None:
+        SearchStats.writeJsonLine(STATS_FILE, record)
+
+
+def aspirationSearch(gs, depth, tt, control, firstMoveID, previousScore):
+    # search a window around the previous iteration's score and widen the
+    # side that failed until the score lands inside it
+    delta = ASPIRATION_WINDOW
+    alpha = previousScore - delta
+    beta = previousScore + delta
+    while True:
+        move, score = searchRoot(gs, depth, tt, control,
+                                 firstMoveID, alpha, beta)
+        if move is None:
+            return move, score
+        if score <= alpha:
+            alpha = -100000 if delta > 4*ASPIRATION_WINDOW else alpha - delta
+        elif score >= beta:
+            beta = 100000 if delta > 4*ASPIRATION_WINDOW else beta + delta
+        else:
+            return move, score
+        delta *= 2
+
+
+def aimoveTimed(gs, timeLimit=None, nodeLimit=None, maxDepth=MAX_SEARCH_DEPTH, tt=None, algorithm=None,
+                control=None, progress=None, book=None):
+    # iterative deepening: search depth 1, 2, 3... until the time (seconds)
+    # or node budget runs out and play the best move of the last completed
+    # depth, trying it first at the next one. With "pvs" every depth after
+    # the first starts from an aspiration window. A ready made control
+    # replaces the limits, progress(depth, score, pv) is called after every
+    # completed depth. A move from the opening book is played right away.
+    book = resolveBook(book)
+    if book is not None:
+        move = book.chooseMove(gs)
+        if move is not None:
+            return move
+    tt = resolveTable(tt)
+    if tt is not None:
+        tt.newSearch()
+    global lastSearch
+    if control is None:
+        control = SearchControl(timeLimit, nodeLimit, algorithm)
+    lastSearch = control
+    moves = gs.getValidMove()
+    if len(moves) <= 1:
+        return moves[0] if moves else None
+    stats = control.stats
+    if stats is None:
+        return iterativeDeepening(gs, moves, maxDepth, tt, control, progress)
+    stats.attach(gs, tt)
+    try:
+        move = iterativeDeepening(gs, moves, maxDepth, tt, control, progress)
+    finally:
+        stats.detach(gs)
+    finishStats(control, tt, move)
+    return move
+
+
+def iterativeDeepening(gs, moves, maxDepth, tt, control, progress):
+    bestMove = None
+    bestScore = None
+    for depth in range(1, maxDepth+1):
+        firstMoveID = bestMove.moveID if bestMove else None
+        if control.algorithm == "pvs" and bestScore is not None:
+            move, score = aspirationSearch(gs, depth, tt, control,
+                                           firstMoveID, bestScore)
+        else:
+            move, score = searchRoot(gs, depth, tt, control, firstMoveID)
+        if move is None:
+            break
+        bestMove = move
+        bestScore = score
+        control.completedDepth = depth
+        if progress is not None or control.stats is not None:
+            pv = principalVariation(gs, tt, depth)
+            pv = pv if pv and pv[0] == move else [move]
+            if control.stats is not None:
+                control.stats.iteration(control, depth, score, pv)
+            if progress is not None:
+                progress(depth, score, pv)
+        if abs(score) > MATE_THRESHOLD:
+            break
+    if bestMove is None:
+        # not even depth 1 finished, fall back to the best looking move
+        orderMoves(moves)
+        bestMove = moves[0]
+    return bestMove
+
+
+class BackgroundSearch():
+    # aimoveTimed on a copy of gs in a daemon thread so the window keeps
+    # drawing. Poll done, then read move. cancel() stops the search at the
+    # next clock check. With ponderMove the copy plays that move first and
+    # searches without a time limit until ponderHit() starts the clock.
+    # finished(search) is called from the search thread once it is done.
+    def __init__(self, gs, timeLimit=None, maxDepth=MAX_SEARCH_DEPTH, progress=None, ponderMove=None,
+                 nodeLimit=None, finished=None, book=None):
+        self.gs = copy.deepcopy(gs)
+        self.ponderMove = ponderMove
+        if ponderMove is not None:
+            self.ponderChoice = ponderMove.promotionChoice
+            self.gs.makeMove(ponderMove)
+        self.control = SearchControl(timeLimit, nodeLimit)
+        self.maxDepth = maxDepth
+        self.progress = progress
+        self.finished = finished
+        self.book = book
+        self.move = None
+        self.score = None
+        self.pv = []
+        self.depth = 0
+        self.done = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        self.move = aimoveTimed(self.gs, maxDepth=self.maxDepth,
+                                control=self.control, progress=self.report, book=self.book)
+        self.done = True
+        if self.finished is not None:
+            self.finished(self)
+
+    def report(self, depth, score, pv):
+        self.depth = depth
+        self.score = score
+        self.pv = pv
+        if self.progress is not None:
+            self.progress(depth, score, pv)
+
+    def isPonderHit(self, move):
+        return self.ponderMove is not None and move == self.ponderMove and \
+            move.promotionChoice == self.ponderChoice
+
+    def ponderHit(self, timeLimit):
+        # the human played ponderMove, the search is now for real
+        self.ponderMove = None
+        self.control.deadline = time.perf_counter() + timeLimit
+
+    def cancel(self):
+        self.control.stopped = True
+        self.thread.join()
+
+    def expectedReply(self):
+        # the opponent's answer to move according to the last completed depth
+        return self.pv[1] if len(self.pv) > 1 else None
+
+
+def printProgress(depth, score, pv):
+    print("depth", depth, "score", score, "pv",
+          " ".join(move.getChessNotation() for move in pv))
+
+
+def qsearch(gs, alpha, beta, depth=None, control=None):
+    # quiescence search: only captures and promotions, or every evasion when
+    # in check, until the position is quiet or depth runs out
+    if depth is None:
+        depth = QSEARCH_DEPTH
+    if control is not None:
+        if control.stopped or control.tick():
+            return 0
+        control.qnodes += 1
+        if control.stats is not None:
+            control.stats.reach(len(gs.zobristLog) - control.rootPly)
+    if depth > 0 and gs.inCheck():
+        # no standing pat in check, every legal reply is searched, with none
+        # left it is mate
+        maxscore = -MATE_SCORE
+        if control is not None:
+            maxscore += len(gs.zobristLog) - control.rootPly
+        for move in MovePicker.pickMoves(gs):
+            if move.isPawnPromotion:
+                move.promotionChoice = 'Q'
+            gs.makeMove(move)
+            score = -qsearch(gs, -beta, -alpha, depth-1, control)
+            gs.undoMove()
+            if control is not None and control.stopped:
+                return 0
+            if score >= beta:
+                return score
+            if score > maxscore:
+                maxscore = score
+            if score > alpha:
+                alpha = score
+        return maxscore
+    if control is not None and control.stats is not None:
+        stndpt = control.stats.measure("eval", staticEval, gs)
+    else:
+        stndpt = staticEval(gs)
+    if depth == 0:
+        return stndpt
+    if stndpt >= beta:
+        return beta
+    if alpha < stndpt:
+        alpha = stndpt
+    for move in MovePicker.pickCaptures(gs):
+        # delta pruning: skip captures that cannot lift the score to alpha
+        # even when the captured piece comes for free
+        gain = QSEARCH_DELTA_MARGIN
+        if move.pieceCaptured != '--':
+            gain += ChessEngine.piecevalues[move.pieceCaptured[1]]
+        if move.isPawnPromotion:
+            move.promotionChoice = 'Q'
+            gain += ChessEngine.piecevalues['Q'] - ChessEngine.piecevalues['P']
+        if stndpt + gain <= alpha:
+            continue
+        gs.makeMove(move)
+        score = -qsearch(gs, -beta, -alpha, depth-1, control)
+        gs.undoMove()
+        if control is not None and control.stopped:
+            return 0
+        if score >= beta:
+            return beta
+        if score > alpha:
+            alpha = score
+    return alpha
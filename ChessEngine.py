@@ -1,4 +1,4 @@
-import pygame
+import Zobrist
 pawntable=[[0,  0,  0,  0,  0,  0,  0,  0],
                [50, 50, 50, 50, 50, 50, 50, 50],
                [10, 10, 20, 30, 30, 20, 10, 10],
@@ -47,7 +47,79 @@ kingtable = [[-30,-40,-40,-50,-50,-40,-40,-30],
                  [-10,-20,-20,-20,-20,-20,-20,-10],
                  [20, 20,  0,  0,  0,  0, 20, 20],
                  [20, 30, 10,  0,  0, 10, 30, 20]]
+# the king walks to the centre once the heavy pieces are gone
+kingendgametable = [[-50,-40,-30,-20,-20,-30,-40,-50],
+                    [-30,-20,-10,  0,  0,-10,-20,-30],
+                    [-30,-10, 20, 30, 30, 20,-10,-30],
+                    [-30,-10, 30, 40, 40, 30,-10,-30],
+                    [-30,-10, 30, 40, 40, 30,-10,-30],
+                    [-30,-10, 20, 30, 30, 20,-10,-30],
+                    [-30,-30,  0,  0,  0,  0,-30,-30],
+                    [-50,-30,-30,-30,-30,-30,-30,-50]]
 piecevalues = {'P':100,'N':320,'B':330,'R':500,'Q':900}
+# game phase: 24 with all pieces on the board, 0 with only kings and pawns.
+# The score slides from the middle game to the endgame tables with it.
+PHASE_WEIGHTS = {'N': 1, 'B': 1, 'R': 2, 'Q': 4}
+MAX_PHASE = 24
+
+
+def buildSquareScores(kingTable):
+    # SCORES[piece][row][col], value plus table bonus signed for the side.
+    # White reads the tables turned by 180 degrees.
+    tables = {'P': pawntable, 'N': knighttable, 'B': bishoptable,
+              'R': rooktable, 'Q': queentable, 'K': kingTable}
+    scores = {}
+    for kind, table in tables.items():
+        value = piecevalues.get(kind, 0)
+        scores["w" + kind] = [[value + table[7 - row][7 - col] for col in range(8)] for row in range(8)]
+        scores["b" + kind] = [[-(value + table[row][col]) for col in range(8)] for row in range(8)]
+    return scores
+
+
+MG_SCORES = buildSquareScores(kingtable)
+EG_SCORES = buildSquareScores(kingendgametable)
+
+# move tables built once at import. RAYS[row][col][j] lists the squares from
+# (row, col) outwards in direction RAY_DIRECTIONS[j], j 0-3 orthogonal and
+# 4-7 diagonal. KNIGHT_TARGETS and KING_TARGETS list the squares a knight or
+# king on (row, col) reaches.
+RAY_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+                  (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (2, -1), (2, 1),
+                (-1, -2), (-1, 2), (1, -2), (1, 2))
+
+
+def buildTargets(jumps):
+    return [[[(row + d[0], col + d[1]) for d in jumps if 0 <= row + d[0] <= 7 and 0 <= col + d[1] <= 7]
+             for col in range(8)] for row in range(8)]
+
+
+def buildRays():
+    rays = []
+    for row in range(8):
+        rowRays = []
+        for col in range(8):
+            squareRays = []
+            for d in RAY_DIRECTIONS:
+                ray = []
+                next_row, next_col = row + d[0], col + d[1]
+                while 0 <= next_row <= 7 and 0 <= next_col <= 7:
+                    ray.append((next_row, next_col))
+                    next_row, next_col = next_row + d[0], next_col + d[1]
+                squareRays.append(tuple(ray))
+            rowRays.append(tuple(squareRays))
+        rays.append(rowRays)
+    return rays
+
+
+KNIGHT_TARGETS = buildTargets(KNIGHT_JUMPS)
+KING_TARGETS = buildTargets(RAY_DIRECTIONS)
+RAYS = buildRays()
+ROOK_RAYS = [[RAYS[row][col][:4] for col in range(8)] for row in range(8)]
+BISHOP_RAYS = [[RAYS[row][col][4:] for col in range(8)] for row in range(8)]
+# FEN castling letter: the king and rook that have to be on their home squares
+CASTLING_SQUARES = {"K": (("wK", 7, 4), ("wR", 7, 7)), "Q": (("wK", 7, 4), ("wR", 7, 0)),
+                    "k": (("bK", 0, 4), ("bR", 0, 7)), "q": (("bK", 0, 4), ("bR", 0, 0))}
 
 class GameState():
     def __init__(self):
@@ -74,9 +146,27 @@ class GameState():
         self.castlingRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
                                                    self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
         self.enpassantPossible = ()
-        self.boardscore = 0
+        # middle game and endgame scores and the phase, kept up to date by
+        # makeMove and undoMove, boardscore blends them
+        self.mgScore, self.egScore, self.phase = evaluatePosition(self.board)
+        # "legal" works out pins and checks up front, "reference" is the old
+        # make/test/undo filter kept around to compare the two against
+        self.moveGenMode = "legal"
+        self.enpassantPossibleLog = []
+        # moves since the last capture or pawn move and the FEN move number
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        self.halfmoveClockLog = []
+        self.zobristKey = Zobrist.computeHash(self)
+        self.zobristLog = []
+        # check the incremental key against a full recomputation every move
+        self.zobristDebug = False
+        self.legalityCache = None
 
     def makeMove(self, move):
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.zobristLog.append(self.zobristKey)
+        self.updateClocks(move)
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)
@@ -116,13 +206,111 @@ class GameState():
         self.updateCastleRights(move)
         self.castlingRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
                                                    self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
-        self.boardscore+=evalmove(move)
+        mg, eg, phase = moveDelta(move)
+        self.mgScore += mg
+        self.egScore += eg
+        self.phase += phase
+        self.updateZobristKey(move)
+        if self.zobristDebug:
+            self.checkZobristKey()
+
+    def updateZobristKey(self, move):
+        # xor out what the move took off the board and in what it put on,
+        # called at the end of makeMove with the logs already pushed
+        pieceKeys = Zobrist.PIECE_KEYS
+        key = self.zobristKey ^ Zobrist.SIDE_KEY
+        key ^= pieceKeys[move.pieceMoved][move.startRow][move.startCol]
+        if move.isEnpassantMove:
+            key ^= pieceKeys[move.pieceCaptured][move.startRow][move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= pieceKeys[move.pieceCaptured][move.endRow][move.endCol]
+        if move.isPawnPromotion:
+            key ^= pieceKeys[move.pieceMoved[0] +
+                             move.promotionChoice][move.endRow][move.endCol]
+        else:
+            key ^= pieceKeys[move.pieceMoved][move.endRow][move.endCol]
+        if move.isCastleMove:
+            rook = pieceKeys[move.pieceMoved[0] + "R"][move.endRow]
+            if move.endCol - move.startCol == 2:
+                key ^= rook[move.endCol+1] ^ rook[move.endCol-1]
+            else:
+                key ^= rook[move.endCol-2] ^ rook[move.endCol+1]
+        oldEnpassant = self.enpassantPossibleLog[-1]
+        if oldEnpassant:
+            key ^= Zobrist.ENPASSANT_KEYS[oldEnpassant[1]]
+        if self.enpassantPossible:
+            key ^= Zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+        key ^= Zobrist.castleKey(self.castlingRightsLog[-2]) ^ \
+            Zobrist.castleKey(self.castlingRightsLog[-1])
+        self.zobristKey = key
+
+    def updateClocks(self, move):
+        # before the side to move flips
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if move.pieceMoved[1] == "P" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+
+    def undoClocks(self):
+        # after the side to move flipped back
+        self.halfmoveClock = self.halfmoveClockLog.pop()
+        if not self.whiteToMove:
+            self.fullmoveNumber -= 1
+
+    def makeNullMove(self):
+        # pass the turn without moving, for null move pruning. Clears the
+        # en passant square and logs like makeMove but leaves moveLog alone.
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.zobristLog.append(self.zobristKey)
+        key = self.zobristKey ^ Zobrist.SIDE_KEY
+        if self.enpassantPossible:
+            key ^= Zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+        self.enpassantPossible = ()
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey = key
+        if self.zobristDebug:
+            self.checkZobristKey()
+
+    def undoNullMove(self):
+        self.whiteToMove = not self.whiteToMove
+        self.enpassantPossible = self.enpassantPossibleLog.pop()
+        self.zobristKey = self.zobristLog.pop()
+
+    def hasNonPawnMaterial(self):
+        # the side to move has a knight, bishop, rook or queen. Without one
+        # zugzwang is likely and passing the turn proves nothing.
+        allyColor = "w" if self.whiteToMove else "b"
+        for row in self.board:
+            for piece in row:
+                if piece[0] == allyColor and piece[1] in "NBRQ":
+                    return True
+        return False
+
+    @property
+    def boardscore(self):
+        # tapered material and piece-square score from white's view
+        return taperedScore(self.mgScore, self.egScore, self.phase)
+
+    def pieceCount(self):
+        # pieces of both colours on the board, kings included
+        return 64 - sum(row.count("--") for row in self.board)
+
+    def checkZobristKey(self):
+        fullKey = Zobrist.computeHash(self)
+        if self.zobristKey != fullKey:
+            raise RuntimeError("zobrist key %x does not match the position (%x) after %s" % (
+                self.zobristKey, fullKey, [m.getChessNotation() for m in self.moveLog]))
+
     def undoMove(self):
         if len(self.moveLog) > 0:
             last_move = self.moveLog.pop()
             self.board[last_move.startRow][last_move.startCol] = last_move.pieceMoved
             self.board[last_move.endRow][last_move.endCol] = last_move.pieceCaptured
             self.whiteToMove = not self.whiteToMove
+            self.undoClocks()
             # track kings
             if last_move.pieceMoved == "wK":
                 self.whiteKingLocation = (
@@ -134,10 +322,8 @@ class GameState():
             if last_move.isEnpassantMove:
                 self.board[last_move.endRow][last_move.endCol] = "--"
                 self.board[last_move.startRow][last_move.endCol] = last_move.pieceCaptured
-                self.enpassantPossible = (last_move.endRow, last_move.endCol)
-            # undo add to enpassant if moved twice
-            if last_move.pieceMoved[1] == "P" and abs(last_move.startRow-last_move.endRow) == 2:
-                self.enpassantPossible = ()
+            self.enpassantPossible = self.enpassantPossibleLog.pop()
+            self.zobristKey = self.zobristLog.pop()
             # undo castle rights
             self.castlingRightsLog.pop()
             newRights = self.castlingRightsLog[-1]
@@ -157,8 +343,19 @@ class GameState():
                     self.board[last_move.endRow][last_move.endCol -
                                                  2] = self.board[last_move.endRow][last_move.endCol + 1]
                     self.board[last_move.endRow][last_move.endCol + 1] = "--"
-            self.boardscore-=evalmove(last_move)
+            mg, eg, phase = moveDelta(last_move)
+            self.mgScore -= mg
+            self.egScore -= eg
+            self.phase -= phase
+            if self.zobristDebug:
+                self.checkZobristKey()
     def getValidMove(self):
+        if self.moveGenMode == "reference":
+            return self.getValidMoveReference()
+        return self.getLegalMoves()
+
+    def getValidMoveReference(self):
+        # make every pseudo legal move and drop the ones leaving the king attacked
         tempCastleRights = CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
                                         self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)
         tempEnpassantPossible = self.enpassantPossible
@@ -193,7 +390,360 @@ class GameState():
         self.currentCastlingRights = tempCastleRights
         return moves
 
+    def getLegalMoves(self):
+        # pins, checks and king danger squares are worked out once, so only
+        # legal moves are emitted and no move has to be made and undone
+        moves = []
+        allyColor = "w" if self.whiteToMove else "b"
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol, allyColor)
+        danger = self.getKingDangerSquares(kingRow, kingCol)
+
+        # king moves
+        kingMoves = []
+        self.getKingMoves(kingRow, kingCol, kingMoves)
+        for move in kingMoves:
+            if (move.endRow, move.endCol) not in danger:
+                moves.append(move)
+
+        # in double check only the king can move
+        if len(checks) < 2:
+            validSquares = None
+            if len(checks) == 1:
+                validSquares = self.getCheckBlockSquares(
+                    kingRow, kingCol, checks[0])
+            candidates = []
+            for row in range(8):
+                for col in range(8):
+                    piece = self.board[row][col]
+                    if piece[0] == allyColor and piece[1] != "K":
+                        self.loopFunctions[piece[1]](row, col, candidates)
+            for move in candidates:
+                if move.isEnpassantMove:
+                    if self.enpassantIsLegal(move, kingRow, kingCol, allyColor):
+                        moves.append(move)
+                    continue
+                if validSquares is not None and (move.endRow, move.endCol) not in validSquares:
+                    continue
+                pin = pins.get((move.startRow, move.startCol))
+                if pin is not None:
+                    # a pinned piece may only slide along the pin line
+                    if (move.endRow-move.startRow)*pin[1] != (move.endCol-move.startCol)*pin[0]:
+                        continue
+                moves.append(move)
+            if len(checks) == 0:
+                self.getLegalCastleMoves(kingRow, kingCol, danger, moves)
+
+        if len(moves) == 0:
+            if len(checks) > 0:
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
+
+    def checkForPinsAndChecks(self, row, col, allyColor):
+        # returns pins as {(row, col): direction} and checks as a list of
+        # (row, col, direction) for the king standing on (row, col)
+        pins = {}
+        checks = []
+        enemyColor = "b" if allyColor == "w" else "w"
+        board = self.board
+        rays = RAYS[row][col]
+        for j in range(8):
+            possiblePin = None
+            i = 0
+            for next_row, next_col in rays[j]:
+                i += 1
+                piece = board[next_row][next_col]
+                if piece == "--":
+                    continue
+                if piece[0] == allyColor and piece[1] != "K":
+                    if possiblePin is None:
+                        possiblePin = (next_row, next_col)
+                        continue
+                    break
+                if piece[0] == allyColor:
+                    break
+                kind = piece[1]
+                # orthogonal rays are j 0-3, diagonal rays j 4-7
+                if (j <= 3 and kind == "R") or (j >= 4 and kind == "B") or kind == "Q" or \
+                        (i == 1 and kind == "P" and ((enemyColor == "w" and j >= 6) or (enemyColor == "b" and 4 <= j <= 5))):
+                    if possiblePin is None:
+                        checks.append((next_row, next_col, RAY_DIRECTIONS[j]))
+                    else:
+                        pins[possiblePin] = RAY_DIRECTIONS[j]
+                break
+        enemyKnight = enemyColor + "N"
+        for next_row, next_col in KNIGHT_TARGETS[row][col]:
+            if board[next_row][next_col] == enemyKnight:
+                checks.append((next_row, next_col,
+                               (next_row - row, next_col - col)))
+        return pins, checks
+
+    def getCheckBlockSquares(self, kingRow, kingCol, check):
+        # squares that capture the checking piece or block its line
+        checkRow, checkCol, d = check
+        if self.board[checkRow][checkCol][1] in ("N", "P"):
+            return {(checkRow, checkCol)}
+        squares = set()
+        for i in range(1, 8):
+            square = (kingRow + d[0]*i, kingCol + d[1]*i)
+            squares.add(square)
+            if square == (checkRow, checkCol):
+                break
+        return squares
+
+    def getKingDangerSquares(self, kingRow, kingCol):
+        # every square the enemy attacks, with our king lifted off the board
+        # so that it cannot hide behind itself on a slider's line
+        enemyColor = "b" if self.whiteToMove else "w"
+        board = self.board
+        king = board[kingRow][kingCol]
+        board[kingRow][kingCol] = "--"
+        danger = set()
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != enemyColor:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    next_row = row + (-1 if enemyColor == "w" else 1)
+                    for next_col in (col-1, col+1):
+                        if self.inside_board(next_row, next_col):
+                            danger.add((next_row, next_col))
+                elif kind == "N":
+                    danger.update(KNIGHT_TARGETS[row][col])
+                elif kind == "K":
+                    danger.update(KING_TARGETS[row][col])
+                else:
+                    if kind == "R":
+                        rays = ROOK_RAYS[row][col]
+                    elif kind == "B":
+                        rays = BISHOP_RAYS[row][col]
+                    else:
+                        rays = RAYS[row][col]
+                    for ray in rays:
+                        for square in ray:
+                            danger.add(square)
+                            if board[square[0]][square[1]] != "--":
+                                break
+        board[kingRow][kingCol] = king
+        return danger
+
+    def enpassantIsLegal(self, move, kingRow, kingCol, allyColor):
+        # en passant lifts two pawns off one rank, so play it on the board and
+        # look for any check instead of relying on the pin map
+        capturedPawn = self.board[move.startRow][move.endCol]
+        self.board[move.startRow][move.startCol] = "--"
+        self.board[move.startRow][move.endCol] = "--"
+        self.board[move.endRow][move.endCol] = move.pieceMoved
+        checks = self.checkForPinsAndChecks(kingRow, kingCol, allyColor)[1]
+        self.board[move.endRow][move.endCol] = "--"
+        self.board[move.startRow][move.endCol] = capturedPawn
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        return len(checks) == 0
+
+    def getLegalCastleMoves(self, row, col, danger, moves):
+        # the king is known not to be in check here
+        if (self.whiteToMove and self.currentCastlingRights.wks) or (not self.whiteToMove and self.currentCastlingRights.bks):
+            if self.board[row][col+1] == "--" and self.board[row][col+2] == "--" and \
+                    (row, col+1) not in danger and (row, col+2) not in danger:
+                moves.append(Move((row, col), (row, col+2),
+                                  self.board, isCastleMove=True))
+        if (self.whiteToMove and self.currentCastlingRights.wqs) or (not self.whiteToMove and self.currentCastlingRights.bqs):
+            if self.board[row][col-1] == "--" and self.board[row][col-2] == "--" and self.board[row][col-3] == "--" and \
+                    (row, col-1) not in danger and (row, col-2) not in danger:
+                moves.append(Move((row, col), (row, col-2),
+                                  self.board, isCastleMove=True))
+
+    def getCaptureMoves(self):
+        # pseudo legal captures, en passant and promotions for the staged
+        # picker, each one still has to pass isLegalMove
+        moves = []
+        allyColor = "w" if self.whiteToMove else "b"
+        enemyColor = "b" if self.whiteToMove else "w"
+        board = self.board
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != allyColor:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    pawnMoves = []
+                    self.getPawnMoves(row, col, pawnMoves)
+                    for move in pawnMoves:
+                        if move.pieceCaptured != "--" or move.isPawnPromotion:
+                            moves.append(move)
+                elif kind == "N" or kind == "K":
+                    targets = KNIGHT_TARGETS[row][col] if kind == "N" else KING_TARGETS[row][col]
+                    for next_row, next_col in targets:
+                        if board[next_row][next_col][0] == enemyColor:
+                            moves.append(
+                                Move((row, col), (next_row, next_col), board))
+                else:
+                    if kind == "R":
+                        rays = ROOK_RAYS[row][col]
+                    elif kind == "B":
+                        rays = BISHOP_RAYS[row][col]
+                    else:
+                        rays = RAYS[row][col]
+                    for ray in rays:
+                        for next_row, next_col in ray:
+                            target = board[next_row][next_col]
+                            if target == "--":
+                                continue
+                            if target[0] == enemyColor:
+                                moves.append(
+                                    Move((row, col), (next_row, next_col), board))
+                            break
+        return moves
+
+    def getQuietMoves(self):
+        # pseudo legal moves to empty squares plus legal castling
+        moves = []
+        allyColor = "w" if self.whiteToMove else "b"
+        board = self.board
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != allyColor:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    pawnMoves = []
+                    self.getPawnMoves(row, col, pawnMoves)
+                    for move in pawnMoves:
+                        if move.pieceCaptured == "--" and not move.isPawnPromotion:
+                            moves.append(move)
+                elif kind == "N" or kind == "K":
+                    targets = KNIGHT_TARGETS[row][col] if kind == "N" else KING_TARGETS[row][col]
+                    for next_row, next_col in targets:
+                        if board[next_row][next_col] == "--":
+                            moves.append(
+                                Move((row, col), (next_row, next_col), board))
+                else:
+                    if kind == "R":
+                        rays = ROOK_RAYS[row][col]
+                    elif kind == "B":
+                        rays = BISHOP_RAYS[row][col]
+                    else:
+                        rays = RAYS[row][col]
+                    for ray in rays:
+                        for next_row, next_col in ray:
+                            if board[next_row][next_col] != "--":
+                                break
+                            moves.append(
+                                Move((row, col), (next_row, next_col), board))
+        kingRow, kingCol, pins, checks, blockSquares = self.getLegalityInfo()
+        if len(checks) == 0:
+            enemyColor = "b" if self.whiteToMove else "w"
+            danger = set()
+            for next_col in (kingCol-2, kingCol-1, kingCol+1, kingCol+2):
+                if 0 <= next_col <= 7 and self.squareAttackedBy(kingRow, next_col, enemyColor):
+                    danger.add((kingRow, next_col))
+            self.getLegalCastleMoves(kingRow, kingCol, danger, moves)
+        return moves
+
+    def getMoveByID(self, moveID):
+        # the pseudo legal move with this id, castling excluded, or None.
+        # Used to check that a remembered hash move fits this position.
+        row, col = moveID // 1000, (moveID // 100) % 10
+        piece = self.board[row][col]
+        if piece[0] != ("w" if self.whiteToMove else "b"):
+            return None
+        pieceMoves = []
+        self.loopFunctions[piece[1]](row, col, pieceMoves)
+        for move in pieceMoves:
+            if move.moveID == moveID:
+                return move
+        return None
+
+    def getLegalityInfo(self):
+        # king square, pins, checks and check block squares of the current
+        # position, cached on the zobrist key
+        cache = self.legalityCache
+        if cache is not None and cache[0] == self.zobristKey:
+            return cache[1]
+        allyColor = "w" if self.whiteToMove else "b"
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol, allyColor)
+        blockSquares = None
+        if len(checks) == 1:
+            blockSquares = self.getCheckBlockSquares(
+                kingRow, kingCol, checks[0])
+        info = (kingRow, kingCol, pins, checks, blockSquares)
+        self.legalityCache = (self.zobristKey, info)
+        return info
+
+    def isLegalMove(self, move):
+        # legality of one move from getCaptureMoves/getQuietMoves
+        kingRow, kingCol, pins, checks, blockSquares = self.getLegalityInfo()
+        if move.pieceMoved[1] == "K":
+            if move.isCastleMove:
+                return True
+            enemyColor = "b" if self.whiteToMove else "w"
+            king = self.board[kingRow][kingCol]
+            self.board[kingRow][kingCol] = "--"
+            attacked = self.squareAttackedBy(
+                move.endRow, move.endCol, enemyColor)
+            self.board[kingRow][kingCol] = king
+            return not attacked
+        if len(checks) > 1:
+            return False
+        if move.isEnpassantMove:
+            return self.enpassantIsLegal(move, kingRow, kingCol, move.pieceMoved[0])
+        if blockSquares is not None and (move.endRow, move.endCol) not in blockSquares:
+            return False
+        pin = pins.get((move.startRow, move.startCol))
+        if pin is not None:
+            return (move.endRow-move.startRow)*pin[1] == (move.endCol-move.startCol)*pin[0]
+        return True
+
+    def squareAttackedBy(self, row, col, enemyColor):
+        board = self.board
+        rays = RAYS[row][col]
+        for j in range(8):
+            for next_row, next_col in rays[j]:
+                piece = board[next_row][next_col]
+                if piece == "--":
+                    continue
+                if piece[0] == enemyColor:
+                    kind = piece[1]
+                    if kind == "Q" or (j <= 3 and kind == "R") or (j >= 4 and kind == "B"):
+                        return True
+                break
+        for next_row, next_col in KNIGHT_TARGETS[row][col]:
+            if board[next_row][next_col] == enemyColor + "N":
+                return True
+        for next_row, next_col in KING_TARGETS[row][col]:
+            if board[next_row][next_col] == enemyColor + "K":
+                return True
+        pawnRow = row + 1 if enemyColor == "w" else row - 1
+        if 0 <= pawnRow <= 7:
+            for next_col in (col-1, col+1):
+                if 0 <= next_col <= 7 and board[pawnRow][next_col] == enemyColor + "P":
+                    return True
+        return False
+
     def inCheck(self):
+        if self.moveGenMode != "reference":
+            allyColor = "w" if self.whiteToMove else "b"
+            if self.whiteToMove:
+                kingRow, kingCol = self.whiteKingLocation
+            else:
+                kingRow, kingCol = self.blackKingLocation
+            return len(self.checkForPinsAndChecks(kingRow, kingCol, allyColor)[1]) > 0
         # verify if the king is in CHECK
         # print("white:", self.whiteKingLocation[0], self.whiteKingLocation[1])
         # print("black:", self.blackKingLocation[0], self.blackKingLocation[1])
@@ -276,106 +826,153 @@ class GameState():
                     Move((row, col), (next_row, side_col), self.board, isEnpassantMove=True))
 
     def getRockMoves(self, row, col, moves):
-        directions = ((0, 1), (1, 0), (-1, 0), (0, -1))
-        enemyColor = "b" if self.whiteToMove == True else "w"
-
-        for d in directions:
-            for i in range(1, 8):
-                next_row = row + d[0]*i
-                next_col = col + d[1]*i
-                if self.inside_board(next_row, next_col) == False:
-                    break
-                if self.board[next_row][next_col] == "--":
-                    moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
-                    continue
-                if self.board[next_row][next_col][0] == enemyColor:
-                    moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
-                    break
-                else:
-                    break
+        self.getSlidingMoves(row, col, ROOK_RAYS[row][col], moves)
 
     def getBishopMoves(self, row, col, moves):
-        directions = ((1, 1), (-1, -1), (-1, 1), (1, -1))
-        enemyColor = "b" if self.whiteToMove == True else "w"
-
-        for d in directions:
-            for i in range(1, 8):
-                next_row = row + d[0]*i
-                next_col = col + d[1]*i
-                if self.inside_board(next_row, next_col) == False:
-                    break
-                if self.board[next_row][next_col] == "--":
-                    moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
-                    continue
-                if self.board[next_row][next_col][0] == enemyColor:
-                    moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
-                    break
-                else:
-                    break
+        self.getSlidingMoves(row, col, BISHOP_RAYS[row][col], moves)
 
     def getQueenMoves(self, row, col, moves):
-        directions = ((0, 1), (1, 0), (-1, 0), (0, -1),
-                      (1, 1), (-1, -1), (-1, 1), (1, -1))
-        enemyColor = "b" if self.whiteToMove == True else "w"
+        self.getSlidingMoves(row, col, RAYS[row][col], moves)
 
-        for d in directions:
-            for i in range(1, 8):
-                next_row = row + d[0]*i
-                next_col = col + d[1]*i
-                if self.inside_board(next_row, next_col) == False:
-                    break
-                if self.board[next_row][next_col] == "--":
+    def getSlidingMoves(self, row, col, rays, moves):
+        # walk each precomputed ray until it leaves the board or hits a piece
+        enemyColor = "b" if self.whiteToMove == True else "w"
+        board = self.board
+        for ray in rays:
+            for next_row, next_col in ray:
+                piece = board[next_row][next_col]
+                if piece == "--":
                     moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
+                        Move((row, col), (next_row, next_col), board))
                     continue
-                if self.board[next_row][next_col][0] == enemyColor:
+                if piece[0] == enemyColor:
                     moves.append(
-                        Move((row, col), (next_row, next_col), self.board))
-                    break
-                else:
-                    break
+                        Move((row, col), (next_row, next_col), board))
+                break
 
     def getKingMoves(self, row, col, moves):
-        directions = ((0, 1), (1, 0), (-1, 0), (0, -1),
-                      (1, 1), (-1, -1), (-1, 1), (1, -1))
-        enemyColor = "b" if self.whiteToMove == True else "w"
-
-        for d in directions:
-            next_row = row + d[0]
-            next_col = col + d[1]
-            if self.inside_board(next_row, next_col) == False:
-                continue
-            elif self.board[next_row][next_col] == "--":
-                moves.append(
-                    Move((row, col), (next_row, next_col), self.board))
-                continue
-            elif self.board[next_row][next_col][0] == enemyColor:
-                moves.append(
-                    Move((row, col), (next_row, next_col), self.board))
+        self.getJumpMoves(row, col, KING_TARGETS[row][col], moves)
 
     def getNightMoves(self, row, col, moves):
-        directions = ((-2, -1), (-2, 1), (2, -1), (2, 1),
-                      (-1, -2), (-1, 2), (1, -2), (1, 2))
-        enemyColor = "b" if self.whiteToMove == True else "w"
+        self.getJumpMoves(row, col, KNIGHT_TARGETS[row][col], moves)
 
-        for d in directions:
-            next_row = row + d[0]
-            next_col = col + d[1]
-            if self.inside_board(next_row, next_col) == False:
-                continue
-            elif self.board[next_row][next_col] == "--":
-                moves.append(
-                    Move((row, col), (next_row, next_col), self.board))
-                continue
-            elif self.board[next_row][next_col][0] == enemyColor:
+    def getJumpMoves(self, row, col, targets, moves):
+        allyColor = "w" if self.whiteToMove == True else "b"
+        board = self.board
+        for next_row, next_col in targets:
+            if board[next_row][next_col][0] != allyColor:
                 moves.append(
-                    Move((row, col), (next_row, next_col), self.board))
+                    Move((row, col), (next_row, next_col), board))
+
+    def loadFen(self, fen):
+        # set up the position from a FEN string. Missing trailing fields
+        # default to white to move, no castling, no en passant and 0 1.
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+        board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(["--"]*int(ch))
+                elif ch.upper() in "PNBRQK":
+                    row.append(("w" if ch.isupper() else "b") + ch.upper())
+                else:
+                    raise ValueError("bad FEN piece %r in %s" % (ch, fields[0]))
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError("bad FEN board: " + fields[0])
+        side = fields[1] if len(fields) > 1 else "w"
+        if side not in ("w", "b"):
+            raise ValueError("bad FEN side to move: " + side)
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("bad FEN move clocks: " + " ".join(fields[4:]))
+        castling = fields[2] if len(fields) > 2 else "-"
+        if castling != "-" and any(ch not in "KQkq" for ch in castling):
+            raise ValueError("bad FEN castling rights: " + castling)
+        for king in ("wK", "bK"):
+            count = sum(row.count(king) for row in board)
+            if count != 1:
+                raise ValueError("FEN needs one %s, found %d: %s" % (king, count, fields[0]))
+        for ch in castling.strip("-"):
+            if any(board[row][col] != piece for piece, row, col in CASTLING_SQUARES[ch]):
+                raise ValueError("FEN castling right %s without its king and rook at home: %s"
+                                 % (ch, fen))
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        if enpassant != "-" and (len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or
+                                 enpassant[1] not in ("3", "6")):
+            raise ValueError("bad FEN en passant square: " + enpassant)
+        self.board = board
+        self.whiteToMove = side == "w"
+        self.currentCastlingRights = CastleRights(
+            "K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        self.castlingRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
+                                               self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
+        if enpassant == "-":
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]],
+                                      Move.filesToCols[enpassant[0]])
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.whiteKingLocation = (row, col)
+                elif board[row][col] == "bK":
+                    self.blackKingLocation = (row, col)
+        self.moveLog = []
+        self.enpassantPossibleLog = []
+        self.zobristLog = []
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.halfmoveClockLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.mgScore, self.egScore, self.phase = evaluatePosition(board)
+        self.zobristKey = Zobrist.computeHash(self)
+
+    def getFen(self):
+        # FEN string of the current position, the inverse of loadFen
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+        rights = self.currentCastlingRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + \
+            ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        return " ".join(("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-",
+                         enpassant, str(self.halfmoveClock), str(self.fullmoveNumber)))
 
     def updateCastleRights(self, move):
+        # a rook captured on its home square takes the right with it
+        if move.pieceCaptured == "wR":
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRights.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.wks = False
+        elif move.pieceCaptured == "bR":
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRights.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.bks = False
         if move.pieceMoved == "wK":
             self.currentCastlingRights.wks = False
             self.currentCastlingRights.wqs = False
@@ -431,23 +1028,33 @@ class Move():
     # opposite of filesToCols
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
+    # fixed attribute slots instead of a per move __dict__, search creates
+    # and drops tens of thousands of these
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "moveID", "promotionChoice", "isPawnPromotion", "isEnpassantMove", "isCastleMove",
+                 "evalDelta")
+
     def __init__(self, startSQ, endSQ, board, promotionChoice="Q", isCastleMove=False, isEnpassantMove=False):
-        self.startRow = startSQ[0]
-        self.startCol = startSQ[1]
-        self.endRow = endSQ[0]
-        self.endCol = endSQ[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow*1000+self.startCol*100+self.endRow*10+self.endCol
+        startRow, startCol = startSQ
+        endRow, endCol = endSQ
+        pieceMoved = board[startRow][startCol]
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved
+        self.moveID = startRow*1000+startCol*100+endRow*10+endCol
         self.promotionChoice = promotionChoice if promotionChoice in (
             "Q", "R", "N", "B") else "Q"
-        self.isPawnPromotion = False
-        if (self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7):
-            self.isPawnPromotion = True
+        self.isPawnPromotion = (pieceMoved == "wP" and endRow == 0) or (
+            pieceMoved == "bP" and endRow == 7)
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = "wP" if self.pieceMoved == "bP" else "bP"
+        if isEnpassantMove:
+            self.pieceCaptured = "wP" if pieceMoved == "bP" else "bP"
+        else:
+            self.pieceCaptured = board[endRow][endCol]
         self.isCastleMove = isCastleMove
+        self.evalDelta = None  # (mg, eg, phase) change, filled by moveDelta
 
     def getChessNotation(self):
         # gets standard notation
@@ -461,6 +1068,9 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __repr__(self):
+        return "Move(" + self.getChessNotation() + ")"
+
 
 class CastleRights():
     def __init__(self, wks, bks, wqs, bqs):
@@ -475,78 +1085,68 @@ def print_text_board(arr):
         for j in i:
             print(j, end=" ")
         print()
-def evalmove(move):
-    score = 0
-    if move.pieceMoved[0] == 'b':
-        if move.pieceMoved[1] == 'P':
-            score -= (pawntable[move.endRow][move.endCol] - pawntable[move.startRow][move.startCol])
-        if move.pieceMoved[1] == 'R':
-            score -= (rooktable[move.endRow][move.endCol] - rooktable[move.startRow][move.startCol])
-        if move.pieceMoved[1] == 'N':
-            score -= (knighttable[move.endRow][move.endCol] - knighttable[move.startRow][move.startCol])
-        if move.pieceMoved[1] == 'B':
-            score -= (bishoptable[move.endRow][move.endCol] - bishoptable[move.startRow][move.startCol])
-        if move.pieceMoved[1] == 'Q':
-            score -= (queentable[move.endRow][move.endCol] - queentable[move.startRow][move.startCol])
-        if move.pieceMoved[1] == 'K':
-            score -= (kingtable[move.endRow][move.endCol] - kingtable[move.startRow][move.startCol])
-    if move.pieceMoved[0] == 'w':
-        if move.pieceMoved[1] == 'P':
-            score += (
-                        pawntable[7 - move.endRow][7 - move.endCol] - pawntable[7 - move.startRow][7 - move.startCol])
-        if move.pieceMoved[1] == 'R':
-            score += (
-                        rooktable[7 - move.endRow][7 - move.endCol] - rooktable[7 - move.startRow][7 - move.startCol])
-        if move.pieceMoved[1] == 'N':
-            score += (knighttable[7 - move.endRow][7 - move.endCol] - knighttable[7 - move.startRow][
-                7 - move.startCol])
-        if move.pieceMoved[1] == 'B':
-            score += (bishoptable[7 - move.endRow][7 - move.endCol] - bishoptable[7 - move.startRow][
-                7 - move.startCol])
-        if move.pieceMoved[1] == 'Q':
-            score += (
-                        queentable[7 - move.endRow][7 - move.endCol] - queentable[7 - move.startRow][7 - move.startCol])
-        if move.pieceMoved[1] == 'K':
-            score += (
-                        kingtable[7 - move.endRow][7 - move.endCol] - kingtable[7 - move.startRow][7 - move.startCol])
-    if move.pieceCaptured!='--':
-        if move.pieceCaptured[0]=='w':
-            score-=piecevalues[move.pieceCaptured[1]]
-            if move.pieceCaptured[1] == 'P':
-                score -= (
-                        pawntable[7 - move.endRow][7 - move.endCol] )
-            if move.pieceCaptured[1] == 'R':
-                score -= (
-                        rooktable[7 - move.endRow][7 - move.endCol])
-            if move.pieceCaptured[1] == 'N':
-                score -= (knighttable[7 - move.endRow][7 - move.endCol] )
-            if move.pieceCaptured[1] == 'B':
-                score -= (bishoptable[7 - move.endRow][7 - move.endCol] )
-            if move.pieceCaptured[1] == 'Q':
-                score -= (
-                        queentable[7 - move.endRow][7 - move.endCol] )
-            if move.pieceCaptured[1] == 'K':
-                score -= (
-                        kingtable[7 - move.endRow][7 - move.endCol])
-        else:
-            score += piecevalues[move.pieceCaptured[1]]
-            if move.pieceCaptured[1] == 'P':
-                score += (
-                        pawntable[move.endRow][move.endCol] )
-            if move.pieceCaptured[1] == 'R':
-                score += (
-                        rooktable[move.endRow][move.endCol])
-            if move.pieceCaptured[1] == 'N':
-                score += (knighttable[move.endRow][move.endCol] )
-            if move.pieceCaptured[1] == 'B':
-                score += (bishoptable[move.endRow][move.endCol] )
-            if move.pieceCaptured[1] == 'Q':
-                score += (
-                        queentable[move.endRow][move.endCol] )
-            if move.pieceCaptured[1] == 'K':
-                score += (
-                        kingtable[move.endRow][move.endCol])
-
-    #print("The eval score is "+str(score))
-    return score
 
+
+def evaluatePosition(board):
+    # (middle game score, endgame score, phase) of the board from scratch,
+    # the numbers makeMove keeps up to date
+    mg = eg = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece == "--":
+                continue
+            mg += MG_SCORES[piece][row][col]
+            eg += EG_SCORES[piece][row][col]
+            phase += PHASE_WEIGHTS.get(piece[1], 0)
+    return mg, eg, phase
+
+
+def taperedScore(mg, eg, phase):
+    phase = min(phase, MAX_PHASE)  # promotions can push it past the start
+    return (mg*phase + eg*(MAX_PHASE - phase)) // MAX_PHASE
+
+
+def evaluateBoard(board):
+    # full tapered material and piece-square score
+    return taperedScore(*evaluatePosition(board))
+
+
+def moveDelta(move):
+    # (mg, eg, phase) change made by move, worked out once and kept on the
+    # move for undoMove and move ordering. Promotions are not kept, their
+    # piece can still be changed after the move was generated.
+    delta = move.evalDelta
+    if delta is not None and not move.isPawnPromotion:
+        return delta
+    piece = move.pieceMoved
+    startRow, startCol, endRow, endCol = move.startRow, move.startCol, move.endRow, move.endCol
+    mgPiece = MG_SCORES[piece]
+    egPiece = EG_SCORES[piece]
+    mg = mgPiece[endRow][endCol] - mgPiece[startRow][startCol]
+    eg = egPiece[endRow][endCol] - egPiece[startRow][startCol]
+    phase = 0
+    if move.isPawnPromotion:
+        promoted = piece[0] + move.promotionChoice
+        mg += MG_SCORES[promoted][endRow][endCol] - mgPiece[endRow][endCol]
+        eg += EG_SCORES[promoted][endRow][endCol] - egPiece[endRow][endCol]
+        phase += PHASE_WEIGHTS[move.promotionChoice]
+    captured = move.pieceCaptured
+    if captured != "--":
+        # an en passant pawn is taken beside the end square
+        row = startRow if move.isEnpassantMove else endRow
+        mg -= MG_SCORES[captured][row][endCol]
+        eg -= EG_SCORES[captured][row][endCol]
+        phase -= PHASE_WEIGHTS.get(captured[1], 0)
+    if move.isCastleMove:
+        rook = piece[0] + "R"
+        rookFrom, rookTo = (7, 5) if endCol == 6 else (0, 3)
+        mg += MG_SCORES[rook][endRow][rookTo] - MG_SCORES[rook][endRow][rookFrom]
+        eg += EG_SCORES[rook][endRow][rookTo] - EG_SCORES[rook][endRow][rookFrom]
+    delta = move.evalDelta = (mg, eg, phase)
+    return delta
+
+
+def evalmove(move):
+    # middle game score change of move, the move ordering key
+    return moveDelta(move)[0]
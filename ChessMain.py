@@ -1,10 +1,19 @@
+import time
 import pygame as p
 import ChessEngine
+import ChessAI
+import Pgn
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT//DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+# position backend, BitboardEngine.BitboardGameState (import it here) is a
+# drop in replacement
+GAME_STATE = ChessEngine.GameState
+AI_MOVE_TIME = 1.0  # seconds the computer thinks per move
+PONDER = True  # keep searching the expected reply while the human thinks
+PGN_FILE = "games.pgn"  # every game played is appended here
 
 
 def loadImages():
@@ -19,65 +28,111 @@ def loadImages():
             # print(temp_image, IMAGES)
 
 
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
+BOARD_COLOURS = [(184, 139, 74), (227, 193, 111)]
+HIGHLIGHT_ALPHA = 80
+FONTS = {}  # SysFont objects by (name, size), building one is slow
+
+
+def getFont(name="comicsansms", size=32):
+    if (name, size) not in FONTS:
+        FONTS[(name, size)] = p.font.SysFont(name, size, True, False)
+    return FONTS[(name, size)]
+
+
+class BoardRenderer():
+    # draws the game into screen square by square and only where something
+    # changed since the last frame: a piece, a highlight or the overlay
+    # text. The board colours are drawn once into a background surface and
+    # the transparent highlight squares are made once. draw() hands only
+    # the changed squares to display.update and does nothing at all while
+    # the position, selection and text stay the same.
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = p.Surface((WIDTH, HEIGHT))
+        drawBoard(self.background)
+        self.highlights = {}
+        for colour in ("red", "blue", "yellow"):
+            sq = p.Surface((SQ_SIZE, SQ_SIZE))
+            sq.set_alpha(HIGHLIGHT_ALPHA)  # set transparency
+            sq.fill(p.Color(colour))
+            self.highlights[colour] = sq
+        self.squares = {}  # (row, col) -> (piece, highlight) on screen
+        self.frameKey = None
+        self.text = None
+
+    def invalidate(self):
+        # repaint everything on the next draw, after something else drew
+        # over the window
+        self.squares = {}
+        self.frameKey = None
+
+    def draw(self, gs, validMoves, sqSelected, text=None):
+        # returns the rects updated, empty when nothing changed
+        frameKey = (gs.zobristKey, gs.whiteToMove, sqSelected, text)
+        if frameKey == self.frameKey:
+            return []
+        self.frameKey = frameKey
+        if text != self.text:
+            # the text spans many squares, start from a clean board
+            self.squares = {}
+            self.text = text
+        highlights = highlightSquares(gs, validMoves, sqSelected)
+        rects = []
+        board = gs.board  # a property on BitboardGameState, read it once
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                state = (board[row][col], highlights.get((row, col)))
+                if self.squares.get((row, col)) == state:
+                    continue
+                self.squares[(row, col)] = state
+                rects.append(self.drawSquare(row, col, *state))
+        if text is not None and rects:
+            rects.append(drawText(self.screen, text))
+        if rects:
+            p.display.update(rects)
+        return rects
+
+    def drawSquare(self, row, col, piece, highlight):
+        rect = p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            # draw image with given location
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
 
 
 def drawBoard(screen):
-    board_colours = [(184, 139, 74), (227, 193, 111)]
-
     for r in range(DIMENSION):
         for c in range(DIMENSION):
             temp_rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            if ((r+c) % 2) == 0:
-                p.draw.rect(screen, board_colours[0], temp_rect)
-            else:
-                p.draw.rect(screen, board_colours[1], temp_rect)
-
-
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            temp_rect = p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            p.draw.rect(screen, BOARD_COLOURS[(r+c) % 2], temp_rect)
 
-            piece_name = board[row][col]
 
-            if piece_name != "--":
-                # draw image with given location
-                screen.blit(IMAGES[piece_name], temp_rect)
-
-
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def highlightSquares(gs, validMoves, sqSelected):
+    # {(row, col): colour} of the highlighted squares
+    highlights = {}
     if sqSelected == ():
-        return
+        return highlights
     r, c = sqSelected
     if(gs.inCheck() == True and gs.whiteToMove):
-        sq = p.Surface((SQ_SIZE, SQ_SIZE))
-        sq.set_alpha(80)
-        sq.fill(p.Color("red"))
-        # draw this object
-        screen.blit(
-            sq, (gs.whiteKingLocation[1] * SQ_SIZE, gs.whiteKingLocation[0] * SQ_SIZE))
+        highlights[gs.whiteKingLocation] = "red"
 
     if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):
-        sq = p.Surface((SQ_SIZE, SQ_SIZE))
-        sq.set_alpha(80)  # set transparency
-        sq.fill(p.Color("blue"))
-        screen.blit(sq, (c*SQ_SIZE, r*SQ_SIZE))  # draw this object
-        sq.fill(p.Color("yellow"))
+        highlights[(r, c)] = "blue"
         for move in validMoves:
             if move.startRow == r and move.startCol == c:
-                screen.blit(sq, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
+                highlights[(move.endRow, move.endCol)] = "yellow"
+    return highlights
 
 
 def drawText(screen, text):
-    font = p.font.SysFont("comicsansms", 32, True, False)
-    textObject = font.render(text, 0, p.Color("Black"))
+    # returns the rect drawn
+    textObject = getFont().render(text, 0, p.Color("Black"))
     textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(
         WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
+    return screen.blit(textObject, textLocation)
 
 
 def turnText(isWhiteToMove):
@@ -91,8 +146,7 @@ def drawOptionBox(screen, human, computer):
     screen.blit(window, (1*SQ_SIZE, 2*SQ_SIZE))
 
     # draw option text
-    font = p.font.SysFont("comicsansms", 32, True, False)
-    textObject = font.render("Play Against ", True, p.Color("Black"))
+    textObject = getFont().render("Play Against ", True, p.Color("Black"))
     textLocation = textObject.get_rect()
     textLocation.center = (WIDTH//2, 3*SQ_SIZE)
     screen.blit(textObject, textLocation)
@@ -111,23 +165,31 @@ def drawOptionWindow(screen, gs, human, computer):
 
 
 def OptionWindow(screen, gs):
+    # the window is drawn once, then the loop sleeps until the next event
     human = p.image.load("images/human.png")
     computer = p.image.load("images/computer.png")
+    drawOptionWindow(screen, gs, human, computer)
+    p.display.flip()
 
     while True:
-        for event in p.event.get():
-            if event.type == p.QUIT:
-                return 0
-            elif event.type == p.MOUSEBUTTONDOWN:
-                location = p.mouse.get_pos()
-                col = location[0]//SQ_SIZE
-                row = location[1]/SQ_SIZE
+        event = p.event.wait()
+        if event.type == p.QUIT:
+            return 0
+        elif event.type == p.MOUSEBUTTONDOWN:
+            location = p.mouse.get_pos()
+            col = location[0]//SQ_SIZE
+            row = location[1]/SQ_SIZE
 
-                if row >= 4 and row <= 5.5 and col in [2, 5]:
-                    return 1 if col == 2 else 2
+            if row >= 4 and row <= 5.5 and col in [2, 5]:
+                return 1 if col == 2 else 2
+        elif event.type in exposeEvents():
+            drawOptionWindow(screen, gs, human, computer)
+            p.display.flip()
 
-        drawOptionWindow(screen, gs, human, computer)
-        p.display.flip()
+
+def exposeEvents():
+    # events telling the window needs repainting, WINDOWEXPOSED is pygame 2
+    return (p.VIDEOEXPOSE, getattr(p, "WINDOWEXPOSED", p.VIDEOEXPOSE))
 
 
 def main():
@@ -135,11 +197,12 @@ def main():
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    gs = GAME_STATE()
     validMoves = gs.getValidMove()
     moveMade = False
     ChessEngine.print_text_board(gs.board)
     loadImages()
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = ()  # box clicked by the user (row,col)
     playerClicks = []  # all clicks by user [(row,col),(row,col)]
@@ -147,21 +210,20 @@ def main():
     p.display.set_caption(turnText(gs.whiteToMove))
     flag = 1
     choice = 1
+    search = None  # running BackgroundSearch, the computer's move or a ponder
     while running:
         if flag:
             flag = 0
             choice = OptionWindow(screen, gs)
             if choice == 0:
                 break
+            renderer.invalidate()
         for event in p.event.get():
-            if not gs.whiteToMove and choice == 2:
-                move = aimove(gs, 3)
-                gs.makeMove(move)
-                moveMade = True
-                p.display.set_caption(turnText(gs.whiteToMove))
-                print(len(gs.moveLog))
             if event.type == p.QUIT:
+                saveGame(gs, choice)
                 running = False
+            elif event.type in exposeEvents():
+                renderer.invalidate()
             # mouse handel
             # mouse press
             elif event.type == p.MOUSEBUTTONDOWN and (gs.whiteToMove or choice == 1):
@@ -200,6 +262,7 @@ def main():
             elif event.type == p.KEYDOWN:
                 if event.key == p.K_z:  # z to undo move
                     print(gs.moveLog)
+                    search = cancelSearch(search)
                     gs.undoMove()
                     if not gs.whiteToMove and choice == 2:
                         gs.undoMove()
@@ -213,7 +276,9 @@ def main():
                     for i in validMoves:
                         print(i.startRow, i.startCol, i.endRow, i.endCol)
                 if event.key == p.K_r:
-                    gs = ChessEngine.GameState()
+                    search = cancelSearch(search)
+                    saveGame(gs, choice)
+                    gs = GAME_STATE()
                     validMoves = gs.getValidMove()
                     playerClicks = []
                     sqSelected = ()
@@ -224,95 +289,64 @@ def main():
             validMoves = gs.getValidMove()
             moveMade = False
             p.display.set_caption(turnText(gs.whiteToMove))
+            if search is not None and search.ponderMove is not None:
+                if gs.moveLog and search.isPonderHit(gs.moveLog[-1]):
+                    search.ponderHit(AI_MOVE_TIME)
+                else:
+                    search = cancelSearch(search)
+
+        if choice == 2 and validMoves and not gameOver:
+            if not gs.whiteToMove:
+                if search is None:
+                    search = ChessAI.BackgroundSearch(gs, AI_MOVE_TIME, progress=ChessAI.printProgress)
+                elif search.done:
+                    move = findMove(validMoves, search.move)
+                    reply = search.expectedReply()
+                    search = None
+                    gs.makeMove(move)
+                    print(len(gs.moveLog))
+                    validMoves = gs.getValidMove()
+                    p.display.set_caption(turnText(gs.whiteToMove))
+                    if PONDER and reply is not None and validMoves:
+                        search = ChessAI.BackgroundSearch(gs, progress=ChessAI.printProgress,
+                                                  ponderMove=findMove(validMoves, reply))
 
-        drawGameState(screen, gs, validMoves, sqSelected)
+        text = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, "Black WON by checkmate")
+                text = "Black WON by checkmate"
             else:
-                drawText(screen, "White WON by checkmate")
+                text = "White WON by checkmate"
+        renderer.draw(gs, validMoves, sqSelected, text)
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-def evaluate(gs):
-    if gs.checkMate:
-        if gs.whiteToMove:
-            return -10000
-        else:
-            return 10000
-    if gs.staleMate:
-        return 0
-    score = gs.boardscore
-    if gs.whiteToMove:
-        return score
-    else:
-        return -score
-
-
-def minimaxalphabeta(gs, alpha, beta, depth):
-    if(depth == 0):
-        return evaluate(gs)
-    maxscore = -10000
-    moves = gs.getValidMove()
-    moves.sort(key=ChessEngine.evalmove, reverse=True)
-    for move in moves:
-        if move.isPawnPromotion:
-            move.promotionChoice = 'Q'
-        gs.makeMove(move)
-        score = -minimaxalphabeta(gs, -beta, -alpha, depth-1)
-        gs.undoMove()
-        if(score >= beta):
-            return score
-        if(score > maxscore):
-            maxscore = score
-        if(score > alpha):
-            alpha = score
-    return maxscore
-
-
-def aimove(gs, depth):
-    machmove = None
-    maxval = -99999
-    alpha = -100000
-    beta = 100000
-    moves = gs.getValidMove()
-    moves.sort(key=ChessEngine.evalmove, reverse=True)
-    for move in moves:
-        if move.isPawnPromotion:
-            move.promotionChoice = 'Q'
-        gs.makeMove(move)
-        val = -minimaxalphabeta(gs, -beta, -alpha, depth-1)
-        gs.undoMove()
-        if(val > maxval):
-            maxval = val
-            machmove = move
-        if(val > alpha):
-            alpha = val
-    return machmove
-
-
-def qsearch(gs, alpha, beta, depth):
-    stndpt = evaluate(gs)
-    if depth == 0:
-        return stndpt
-    if stndpt >= beta:
-        return beta
-    if alpha < stndpt:
-        alpha = stndpt
-    moves = gs.getValidMove()
-    moves.sort(key=ChessEngine.evalmove, reverse=True)
-    for move in moves:
-        if move.pieceCaptured != '--':
-            gs.makeMove(move)
-            score = -qsearch(gs, -beta, -alpha, depth-1)
-            gs.undoMove()
-            if score >= beta:
-                return beta
-            if score > alpha:
-                alpha = score
-    return alpha
+    cancelSearch(search)
+
+
+def saveGame(gs, choice):
+    # appends the game to PGN_FILE, unless no move was played
+    if not gs.moveLog:
+        return
+    tags = {"Event": "Chess-AI game", "Date": time.strftime("%Y.%m.%d"),
+            "White": "Human", "Black": "Human" if choice == 1 else "Chess-AI"}
+    Pgn.writePgn(PGN_FILE, [Pgn.gameRecord(gs, tags)], append=True)
+    print("game saved to", PGN_FILE)
+
+
+def cancelSearch(search):
+    # stops a running BackgroundSearch, returns the new (empty) search slot
+    if search is not None:
+        search.cancel()
+    return None
+
+
+def findMove(validMoves, move):
+    # the move of validMoves equal to one found on a copy of the game state
+    for validMove in validMoves:
+        if validMove == move:
+            validMove.promotionChoice = move.promotionChoice
+            return validMove
+    return None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import ChessEngine
+
+# EPD (extended position description) files: the first four FEN fields and
+# then opcode/operand operations ending in semicolons, one position a line:
+#   rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 bm e5; id "x";
+# Files are read a line at a time, so any size streams in constant memory.
+STRING_OPCODES = ("id",) + tuple("c%d" % i for i in range(10))  # quoted operands
+
+
+def splitOperations(text):
+    # {opcode: operand string} of the operations in text, quotes stripped.
+    # Semicolons inside quoted operands do not end the operation.
+    operations = {}
+    current = ""
+    quoted = False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ";" and not quoted:
+            addOperation(operations, current)
+            current = ""
+            continue
+        current += ch
+    addOperation(operations, current)
+    return operations
+
+
+def addOperation(operations, text):
+    parts = text.strip().split(None, 1)
+    if parts:
+        operand = parts[1].strip() if len(parts) > 1 else ""
+        if len(operand) >= 2 and operand[0] == '"' and operand[-1] == '"':
+            operand = operand[1:-1]
+        operations[parts[0]] = operand
+
+
+def parseEpd(line):
+    # (fen, operations) of one EPD line, the hmvc and fmvn operations fill
+    # in the FEN move clocks
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("bad EPD line: " + line.strip())
+    operations = splitOperations(fields[4]) if len(fields) > 4 else {}
+    fen = " ".join(fields[:4] + [operations.get("hmvc", "0"), operations.get("fmvn", "1")])
+    return fen, operations
+
+
+def readEpd(path):
+    # yields (fen, operations) for every position in the file, blank lines
+    # and lines starting with # are skipped
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield parseEpd(line)
+
+
+def readPositions(path, gameState=ChessEngine.GameState):
+    # yields (game state, operations), a new gameState() for every line
+    for fen, operations in readEpd(path):
+        gs = gameState()
+        gs.loadFen(fen)
+        yield gs, operations
+
+
+def epdLine(gs, operations=None):
+    # EPD line of gs, the move clocks go into hmvc and fmvn operations
+    fields = gs.getFen().split()
+    operations = dict(operations or {})
+    operations["hmvc"] = fields[4]
+    operations["fmvn"] = fields[5]
+    text = []
+    for opcode, operand in operations.items():
+        if opcode in STRING_OPCODES:
+            operand = '"' + operand + '"'
+        text.append(opcode + (" " + operand if operand else "") + ";")
+    return " ".join(fields[:4] + text)
+
+
+def writeEpd(path, positions):
+    # writes (game state, operations) pairs one line each, returns the count
+    count = 0
+    with open(path, "w") as file:
+        for gs, operations in positions:
+            file.write(epdLine(gs, operations) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,361 @@
+import argparse
+import ast
+import concurrent.futures
+import json
+import math
+import os
+import time
+import traceback
+import ChessEngine
+import ChessAI
+import Epd
+import OpeningBook
+import Pgn
+import TranspositionTable
+
+# Self-play matches between engine configurations, one game per task on a
+# process pool. An engine is a name plus ChessAI settings that differ from
+# the defaults, written "name:SETTING=value,SETTING=value". Every opening is
+# played twice with colours swapped. Each finished game is appended to a
+# JSON lines file straight away, and a rerun with the same file skips the
+# games already in it. Results count from the first engine's side, the
+# Elo estimate and the SPRT (sequential probability ratio test) are
+# updated after every game and the match stops once the SPRT decides.
+MATCH_TT_MB = 4  # per engine and worker
+MAX_PLIES = 400  # longer games are drawn
+RESIGN_SCORE = 1000  # both engines agree for RESIGN_MOVES moves each
+RESIGN_MOVES = 3
+DRAW_SCORE = 10  # both engines see a dead draw for DRAW_MOVES moves each
+DRAW_MOVES = 8
+DRAW_MIN_PLY = 80
+MAX_RETRIES = 2  # a game that keeps crashing its worker is dropped
+OPENINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "openings.txt")
+
+
+def parseEngine(spec):
+    # "name:SETTING=value,..." -> (name, {SETTING: value})
+    name, _, settings = spec.partition(":")
+    overrides = {}
+    for item in settings.split(","):
+        if not item.strip():
+            continue
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if not hasattr(ChessAI, key):
+            raise ValueError("no ChessAI setting " + key)
+        try:
+            overrides[key] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            overrides[key] = value.strip()
+    return name.strip() or spec, overrides
+
+
+def loadOpenings(path, plies):
+    # start FENs: an .epd file as it is, otherwise every game of a .pgn or
+    # move list file cut to plies moves
+    openings = []
+    if path.lower().endswith(".epd"):
+        for fen, operations in Epd.readEpd(path):
+            openings.append(fen)
+        return openings
+    for moves in OpeningBook.readGames(path):
+        gs = ChessEngine.GameState()
+        for text in moves[:plies]:
+            move = OpeningBook.parseMove(gs, text)
+            if move is None:
+                break
+            gs.makeMove(move)
+        openings.append(gs.getFen())
+    return openings
+
+
+def insufficientMaterial(gs):
+    # bare kings or kings and one minor piece
+    minors = 0
+    for row in gs.board:
+        for piece in row:
+            if piece == "--" or piece[1] == "K":
+                continue
+            if piece[1] in "NB":
+                minors += 1
+            else:
+                return False
+    return minors <= 1
+
+
+def repetitions(gs):
+    # how often the current position occurred since the last irreversible move
+    history = gs.zobristLog[max(0, len(gs.zobristLog) - gs.halfmoveClock):] if gs.halfmoveClock else []
+    return 1 + history.count(gs.zobristKey)
+
+
+def playGame(game, fen, engines, timeLimit=None, nodeLimit=None):
+    # plays one game from fen, engines is [(name, overrides)] for white and
+    # black. Returns a result record, with an error entry if it failed.
+    try:
+        gs = ChessEngine.GameState()
+        gs.loadFen(fen)
+        tables = [TranspositionTable.TranspositionTable(MATCH_TT_MB) for engine in engines]
+        scores = [[], []]  # per side, the last scores from its own view
+        moves = []
+        result = reason = None
+        while result is None:
+            validMoves = gs.getValidMove()
+            if gs.checkMate:
+                result, reason = ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+                break
+            if gs.staleMate:
+                result, reason = "1/2-1/2", "stalemate"
+                break
+            if gs.halfmoveClock >= 100:
+                result, reason = "1/2-1/2", "fifty moves"
+                break
+            if repetitions(gs) >= 3:
+                result, reason = "1/2-1/2", "repetition"
+                break
+            if insufficientMaterial(gs):
+                result, reason = "1/2-1/2", "insufficient material"
+                break
+            if len(moves) >= MAX_PLIES:
+                result, reason = "1/2-1/2", "move limit"
+                break
+            side = 0 if gs.whiteToMove else 1
+            name, overrides = engines[side]
+            searchScores = []
+            saved = {key: getattr(ChessAI, key) for key in overrides}
+            try:
+                for key, value in overrides.items():
+                    setattr(ChessAI, key, value)
+                move = ChessAI.aimoveTimed(gs, timeLimit, nodeLimit, tt=tables[side], book=False,
+                                           progress=lambda depth, score, pv: searchScores.append(score))
+            finally:
+                for key, value in saved.items():
+                    setattr(ChessAI, key, value)
+            if move is None:
+                move = validMoves[0]
+            moves.append(move.getChessNotation() + (move.promotionChoice.lower() if move.isPawnPromotion else ""))
+            gs.makeMove(move)
+            if searchScores:
+                scores[side].append(searchScores[-1])
+            result, reason = adjudicate(scores, len(moves))
+        return {"game": game, "fen": fen, "white": engines[0][0], "black": engines[1][0],
+                "result": result, "reason": reason, "plies": len(moves), "moves": " ".join(moves)}
+    except Exception:
+        return {"game": game, "fen": fen, "error": traceback.format_exc()}
+
+
+def adjudicate(scores, plies):
+    # (result, reason) once both engines agree the game is decided, else
+    # (None, None). scores[0] are white's, scores[1] black's, each from the
+    # engine's own side.
+    white, black = scores
+    if len(white) >= RESIGN_MOVES and len(black) >= RESIGN_MOVES:
+        if all(score >= RESIGN_SCORE for score in white[-RESIGN_MOVES:]) and \
+                all(score <= -RESIGN_SCORE for score in black[-RESIGN_MOVES:]):
+            return "1-0", "adjudicated win"
+        if all(score <= -RESIGN_SCORE for score in white[-RESIGN_MOVES:]) and \
+                all(score >= RESIGN_SCORE for score in black[-RESIGN_MOVES:]):
+            return "0-1", "adjudicated win"
+    if plies >= DRAW_MIN_PLY and len(white) >= DRAW_MOVES and len(black) >= DRAW_MOVES:
+        if all(abs(score) <= DRAW_SCORE for score in white[-DRAW_MOVES:] + black[-DRAW_MOVES:]):
+            return "1/2-1/2", "adjudicated draw"
+    return None, None
+
+
+def eloDifference(wins, draws, losses):
+    # (Elo, 95% error margin) of the first engine from its score
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    if score <= 0 or score >= 1:
+        return (math.inf if score >= 1 else -math.inf), math.inf
+    variance = (wins * (1 - score)**2 + draws * (0.5 - score)**2 + losses * score**2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return scoreToElo(score), (scoreToElo(min(score + margin, 0.999)) - scoreToElo(max(score - margin, 0.001))) / 2
+
+
+def scoreToElo(score):
+    return -400 * math.log10(1 / score - 1)
+
+
+def eloToScore(elo):
+    return 1 / (1 + 10**(-elo / 400))
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha=0.05, beta=0.05):
+    # (log likelihood ratio, lower bound, upper bound) of H1 elo1 against
+    # H0 elo0, normal approximation of the game results. Above the upper
+    # bound H1 is accepted, below the lower one H0.
+    lower = math.log(beta / (1 - alpha))
+    upper = math.log((1 - beta) / alpha)
+    games = wins + draws + losses
+    if games == 0 or wins + losses == 0:
+        return 0.0, lower, upper
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score**2
+    if variance <= 0:
+        return 0.0, lower, upper
+    score0, score1 = eloToScore(elo0), eloToScore(elo1)
+    llr = games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+    return llr, lower, upper
+
+
+class MatchStats():
+    # wins, draws and losses of the first engine
+    def __init__(self, first):
+        self.first = first
+        self.wins = self.draws = self.losses = 0
+
+    def add(self, record):
+        result = record["result"]
+        if result == "1/2-1/2":
+            self.draws += 1
+        elif (result == "1-0") == (record["white"] == self.first):
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def line(self, elo0=None, elo1=None):
+        elo, margin = eloDifference(self.wins, self.draws, self.losses)
+        text = "games %d +%d =%d -%d elo %.1f +/- %.1f" % (
+            self.games(), self.wins, self.draws, self.losses, elo, margin)
+        if elo0 is not None:
+            llr, lower, upper = sprt(self.wins, self.draws, self.losses, elo0, elo1)
+            text += " llr %.2f (%.2f, %.2f)" % (llr, lower, upper)
+        return text
+
+
+def gameSchedule(openings, engines, games):
+    # (game, fen, [white, black]): each opening twice with colours swapped
+    for game in range(games):
+        fen = openings[(game // 2) % len(openings)]
+        pair = engines if game % 2 == 0 else engines[::-1]
+        yield game, fen, list(pair)
+
+
+def readResults(path):
+    # finished game records of an earlier run of the same match
+    records = []
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    if "error" not in record:
+                        records.append(record)
+    return records
+
+
+def gamePgn(record):
+    # (tags, moves) PGN game of a result record
+    gs = ChessEngine.GameState()
+    gs.loadFen(record["fen"])
+    for text in record["moves"].split():
+        gs.makeMove(OpeningBook.parseMove(gs, text))
+    tags = {"Event": "Match", "Round": record["game"] + 1, "White": record["white"],
+            "Black": record["black"], "Termination": record["reason"]}
+    return Pgn.gameRecord(gs, tags, record["result"])
+
+
+def runMatch(engines, openings, games, output, workers=None, timeLimit=None, nodeLimit=None,
+             elo0=None, elo1=None, log=print, pgn=None):
+    # plays the match on a process pool and returns its MatchStats. The pool
+    # always has workers*2 games queued. If a worker process dies the pool
+    # is rebuilt and its unfinished games go back into the queue.
+    stats = MatchStats(engines[0][0])
+    done = set()
+    for record in readResults(output):
+        done.add(record["game"])
+        stats.add(record)
+    pending = [task for task in gameSchedule(openings, engines, games) if task[0] not in done]
+    pending.reverse()
+    retries = {}
+    workers = workers or os.cpu_count() or 1
+    decided = False
+    with open(output, "a") as file:
+        while pending and not decided:
+            executor = concurrent.futures.ProcessPoolExecutor(workers)
+            running = {}
+            try:
+                while (pending or running) and not decided:
+                    while pending and len(running) < workers * 2:
+                        task = pending.pop()
+                        running[executor.submit(playGame, *task, timeLimit, nodeLimit)] = task
+                    finished, rest = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        task = running[future]
+                        record = future.result()  # raises if the worker died
+                        del running[future]
+                        if "error" in record:
+                            log("game %d failed:\n%s" % (task[0], record["error"]))
+                            retries[task[0]] = retries.get(task[0], 0) + 1
+                            if retries[task[0]] <= MAX_RETRIES:
+                                pending.append(task)
+                            continue
+                        file.write(json.dumps(record) + "\n")
+                        file.flush()
+                        if pgn is not None:
+                            Pgn.writePgn(pgn, [gamePgn(record)], append=True)
+                        stats.add(record)
+                        log(stats.line(elo0, elo1))
+                        if elo0 is not None:
+                            llr, lower, upper = sprt(stats.wins, stats.draws, stats.losses, elo0, elo1)
+                            if llr >= upper or llr <= lower:
+                                log("SPRT accepts %s" % ("H1" if llr >= upper else "H0"))
+                                decided = True
+                                break
+            except concurrent.futures.process.BrokenProcessPool:
+                # a worker died, the games it and the others had in hand
+                # are played again on a fresh pool
+                log("worker crashed, restarting the pool")
+                for future, task in running.items():
+                    retries[task[0]] = retries.get(task[0], 0) + 1
+                    if retries[task[0]] <= MAX_RETRIES:
+                        pending.append(task)
+            finally:
+                executor.shutdown(wait=not decided, cancel_futures=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine configurations against each other")
+    parser.add_argument("--engine", action="append", required=True,
+                        help="name:SETTING=value,... twice, the first is the one under test")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--openings", default=OPENINGS_FILE,
+                        help=".epd, .pgn or move list file of start positions")
+    parser.add_argument("--plies", type=int, default=8,
+                        help="moves played from each opening line")
+    parser.add_argument("--movetime", type=float, default=None, help="seconds per move")
+    parser.add_argument("--nodes", type=int, default=None, help="nodes per move")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="match.jsonl",
+                        help="results file, games already in it are skipped")
+    parser.add_argument("--pgn", default=None, help="also append every game to this PGN file")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), default=None,
+                        help="stop once the SPRT of elo0 against elo1 is decided")
+    args = parser.parse_args()
+
+    if len(args.engine) != 2:
+        parser.error("give exactly two --engine configurations")
+    engines = [parseEngine(spec) for spec in args.engine]
+    if engines[0][0] == engines[1][0]:
+        parser.error("the engines need different names")
+    if args.movetime is None and args.nodes is None:
+        args.nodes = 5000
+    openings = loadOpenings(args.openings, args.plies)
+    elo0, elo1 = args.sprt if args.sprt else (None, None)
+    start = time.perf_counter()
+    stats = runMatch(engines, openings, args.games, args.out, args.workers,
+                     args.movetime, args.nodes, elo0, elo1, pgn=args.pgn)
+    print("%s in %.1fs" % (stats.line(elo0, elo1), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
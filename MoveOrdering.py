@@ -0,0 +1,76 @@
+MAX_PLY = 128
+# piece ranks for MVV-LVA, the most valuable victim first and among equal
+# victims the least valuable attacker
+ORDER_VALUES = {"P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6}
+HISTORY_LIMIT = 1 << 20  # all history scores are halved past this
+
+
+def mvvLva(move):
+    # capture ordering score, a promotion counts as winning a queen
+    if move.pieceCaptured != "--":
+        victim = ORDER_VALUES[move.pieceCaptured[1]]
+    elif move.isPawnPromotion:
+        victim = ORDER_VALUES["Q"]
+    else:
+        return 0
+    return victim * 10 - ORDER_VALUES[move.pieceMoved[1]]
+
+
+def isQuiet(move):
+    return move.pieceCaptured == "--" and not move.isPawnPromotion
+
+
+class MoveOrdering():
+    # killer moves (two quiet moves per ply that caused a beta cutoff) and a
+    # butterfly history table (from square x to square per colour) that
+    # collects depth*depth for every quiet cutoff move. One instance lives
+    # for a whole search so later iterations learn from earlier ones.
+    def __init__(self):
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.history = {"w": [[0]*64 for sq in range(64)],
+                        "b": [[0]*64 for sq in range(64)]}
+
+    def killersAt(self, ply):
+        if ply < MAX_PLY:
+            return self.killers[ply]
+        return (None, None)
+
+    def addKiller(self, ply, moveID):
+        if ply >= MAX_PLY:
+            return
+        slots = self.killers[ply]
+        if slots[0] != moveID:
+            slots[1] = slots[0]
+            slots[0] = moveID
+
+    def historyScore(self, move):
+        return self.history[move.pieceMoved[0]][move.startRow*8 + move.startCol][move.endRow*8 + move.endCol]
+
+    def updateHistory(self, move, depth):
+        table = self.history[move.pieceMoved[0]]
+        fromRow = table[move.startRow*8 + move.startCol]
+        to = move.endRow*8 + move.endCol
+        fromRow[to] += depth*depth
+        if fromRow[to] > HISTORY_LIMIT:
+            for color in self.history:
+                for row in self.history[color]:
+                    for i in range(64):
+                        row[i] //= 2
+
+    def recordCutoff(self, move, ply, depth):
+        # a quiet move refuted the opponent's last move
+        if isQuiet(move):
+            self.addKiller(ply, move.moveID)
+            self.updateHistory(move, depth)
+
+    def scoreMove(self, move, ply):
+        # one number for sorting a full move list: captures and promotions
+        # first, then killers, then quiet moves by history
+        if not isQuiet(move):
+            return 3 * HISTORY_LIMIT + mvvLva(move)
+        killers = self.killersAt(ply)
+        if move.moveID == killers[0]:
+            return 2 * HISTORY_LIMIT + 1
+        if move.moveID == killers[1]:
+            return 2 * HISTORY_LIMIT
+        return self.historyScore(move)
@@ -0,0 +1,75 @@
+import ChessEngine
+import MoveOrdering
+
+
+def isGoodCapture(gs, move):
+    # promotions, king captures (the king only takes what it legally may),
+    # winning or equal trades by piece value and captures of undefended
+    # pieces. Anything else likely loses the capturing piece.
+    if move.pieceCaptured == "--" or move.pieceMoved[1] == "K":
+        return True
+    # compared in whole pawns so knight and bishop trade evenly
+    if ChessEngine.piecevalues[move.pieceCaptured[1]] // 100 >= ChessEngine.piecevalues[move.pieceMoved[1]] // 100:
+        return True
+    return not gs.squareAttackedBy(move.endRow, move.endCol, move.pieceCaptured[0])
+
+
+def pickMoves(gs, hashMoveID=None, ordering=None, ply=0):
+    # yields the legal moves of gs in stages: hash move, good captures by
+    # MVV-LVA, killer moves, quiet moves by history, bad captures. Each stage
+    # is only generated once the previous one is used up and legality is
+    # only checked on the move about to be yielded, so a cutoff on an early
+    # move skips most of the work. ordering is a MoveOrdering.MoveOrdering
+    # with the killers and history of the running search, or None.
+    # The caller makes and undoes moves between yields.
+    if hashMoveID is not None:
+        move = gs.getMoveByID(hashMoveID)
+        if move is not None and gs.isLegalMove(move):
+            yield move
+        else:
+            hashMoveID = None
+
+    captures = gs.getCaptureMoves()
+    captures.sort(key=MoveOrdering.mvvLva, reverse=True)
+    badCaptures = []
+    for move in captures:
+        if move.moveID == hashMoveID:
+            continue
+        if not isGoodCapture(gs, move):
+            badCaptures.append(move)
+        elif gs.isLegalMove(move):
+            yield move
+
+    killerIDs = []
+    if ordering is not None:
+        for moveID in ordering.killersAt(ply):
+            if moveID is None or moveID == hashMoveID:
+                continue
+            move = gs.getMoveByID(moveID)
+            if move is not None and MoveOrdering.isQuiet(move) and gs.isLegalMove(move):
+                killerIDs.append(moveID)
+                yield move
+
+    quiets = gs.getQuietMoves()
+    # piece-square gain breaks ties between equal history scores
+    quiets.sort(key=ChessEngine.evalmove, reverse=True)
+    if ordering is not None:
+        quiets.sort(key=ordering.historyScore, reverse=True)
+    for move in quiets:
+        if move.moveID != hashMoveID and move.moveID not in killerIDs and gs.isLegalMove(move):
+            yield move
+
+    for move in badCaptures:
+        if gs.isLegalMove(move):
+            yield move
+
+
+def pickCaptures(gs):
+    # legal captures and promotions that do not lose material, for the
+    # quiescence search. Bad captures are left out, they rarely hold up
+    # and would blow the capture tree up.
+    captures = gs.getCaptureMoves()
+    captures.sort(key=MoveOrdering.mvvLva, reverse=True)
+    for move in captures:
+        if isGoodCapture(gs, move) and gs.isLegalMove(move):
+            yield move
@@ -0,0 +1,293 @@
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import ChessEngine
+
+# Binary opening book. Every entry is 16 bytes, big endian: the 64 bit
+# Zobrist key of the position, the move (from square << 6 | to square, the
+# promotion piece in the bits above, squares are row*8 + col), a 16 bit
+# weight and 32 unused bits. Entries are sorted by key, then by weight
+# from high to low, so all moves of a position sit next to each other and
+# a binary search finds the first one.
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+PROMOTIONS = ("", "N", "B", "R", "Q")
+MAX_WEIGHT = 0xFFFF
+BOOK_PLIES = 20  # moves per game that go into a built book
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+COORDINATES = re.compile(r"^([a-h])([1-8])([a-h])([1-8])([nbrqNBRQ]?)$")
+SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h])([1-8])(?:=?([NBRQ]))?$")
+
+
+def encodeMove(move):
+    code = (move.startRow*8 + move.startCol) << 6 | (move.endRow*8 + move.endCol)
+    if move.isPawnPromotion:
+        code |= PROMOTIONS.index(move.promotionChoice) << 12
+    return code
+
+
+def decodeMove(gs, code):
+    # the legal move of gs with this code, or None
+    start, end = (code >> 6) & 63, code & 63
+    moveID = (start // 8)*1000 + (start % 8)*100 + (end // 8)*10 + end % 8
+    for move in gs.getValidMove():
+        if move.moveID == moveID:
+            if move.isPawnPromotion:
+                move.promotionChoice = PROMOTIONS[code >> 12] or "Q"
+            return move
+    return None
+
+
+def sanMove(move, validMoves):
+    # standard algebraic notation of move without check marks, validMoves
+    # are the legal moves of the position for disambiguation
+    if move.isCastleMove:
+        return "O-O" if move.endCol == 6 else "O-O-O"
+    target = move.getRankFile(move.endRow, move.endCol)
+    capture = move.pieceCaptured != "--"
+    if move.pieceMoved[1] == "P":
+        san = (move.colsToFiles[move.startCol] + "x" if capture else "") + target
+        if move.isPawnPromotion:
+            san += "=" + move.promotionChoice
+        return san
+    others = [other for other in validMoves
+              if other.pieceMoved == move.pieceMoved and other.moveID != move.moveID and
+              other.endRow == move.endRow and other.endCol == move.endCol]
+    origin = ""
+    if others:
+        if all(other.startCol != move.startCol for other in others):
+            origin = move.colsToFiles[move.startCol]
+        elif all(other.startRow != move.startRow for other in others):
+            origin = move.rowsToRanks[move.startRow]
+        else:
+            origin = move.getRankFile(move.startRow, move.startCol)
+    return move.pieceMoved[1] + origin + ("x" if capture else "") + target
+
+
+def parseMove(gs, text):
+    # the legal move of gs written as coordinates (e2e4, e7e8q) or SAN
+    # (Nf3, exd5, O-O, e8=Q+), or None. Most moves are found by
+    # resolveMove without generating every legal move, castling and
+    # anything it cannot settle go through the full legal list.
+    text = text.rstrip("+#!?")
+    if not text:
+        return None
+    move = resolveMove(gs, text)
+    if move is not None:
+        return move
+    validMoves = gs.getValidMove()
+    promotion = ""
+    if len(text) == 5 and text[4].upper() in "NBRQ" and text[:4].isalnum():
+        promotion = text[4].upper()
+        coordinates = text[:4]
+    else:
+        coordinates = text
+    for move in validMoves:
+        if move.getChessNotation() == coordinates:
+            if move.isPawnPromotion:
+                move.promotionChoice = promotion or "Q"
+            return move
+    text = text.replace("0", "O")
+    promotion = re.search(r"=?([NBRQ])$", text) if text[0] in "abcdefgh" else None
+    for move in validMoves:
+        if move.isPawnPromotion:
+            if promotion is None:
+                continue
+            move.promotionChoice = promotion.group(1)
+            if sanMove(move, validMoves) == text[:promotion.start()] + "=" + promotion.group(1):
+                return move
+        elif sanMove(move, validMoves) == text:
+            return move
+    return None
+
+
+def resolveMove(gs, text):
+    # fast path of parseMove: only the squares holding the piece the text
+    # names are tried, one getMoveByID and isLegalMove each. None when the
+    # text is not plain coordinates or SAN, or does not name exactly one
+    # legal move.
+    ranks, files = ChessEngine.Move.ranksToRows, ChessEngine.Move.filesToCols
+    match = COORDINATES.match(text)
+    if match is not None:
+        fromFile, fromRank, toFile, toRank, promotion = match.groups()
+        move = legalMove(gs, ranks[fromRank], files[fromFile], ranks[toRank], files[toFile])
+        if move is not None and move.isPawnPromotion:
+            move.promotionChoice = promotion.upper() or "Q"
+        return move
+    match = SAN.match(text)
+    if match is None:
+        return None
+    piece, fromFile, fromRank, toFile, toRank, promotion = match.groups()
+    name = ("w" if gs.whiteToMove else "b") + (piece or "P")
+    endRow, endCol = ranks[toRank], files[toFile]
+    if fromFile is not None:
+        cols = (files[fromFile],)
+    else:
+        cols = range(8) if piece else (endCol,)
+    rows = (ranks[fromRank],) if fromRank is not None else range(8)
+    board = gs.board  # a property on BitboardGameState
+    found = None
+    for row in rows:
+        for col in cols:
+            if board[row][col] != name:
+                continue
+            move = legalMove(gs, row, col, endRow, endCol)
+            if move is not None:
+                if found is not None:
+                    return None  # ambiguous
+                found = move
+    if found is None or found.isPawnPromotion != (promotion is not None):
+        return None
+    if promotion:
+        found.promotionChoice = promotion
+    return found
+
+
+def legalMove(gs, startRow, startCol, endRow, endCol):
+    # the legal move between two squares, castling excluded, or None
+    move = gs.getMoveByID(startRow*1000 + startCol*100 + endRow*10 + endCol)
+    if move is None or not gs.isLegalMove(move):
+        return None
+    return move
+
+
+def readGames(path):
+    # move lists of the games in path: a .pgn file, or one game per line of
+    # moves in coordinates or SAN. Yields lists of move strings.
+    if path.lower().endswith(".pgn"):
+        import Pgn  # Pgn builds on this module
+        for tags, moves in Pgn.readPgn(path):
+            if moves:
+                yield moves
+        return
+    with open(path) as file:
+        for line in file:
+            # a comment starts at a "#" token, "Qxf7#" is a mating move
+            moves = pgnMoves(re.split(r"(?:^|\s)#", line)[0])
+            if moves:
+                yield moves
+
+
+def pgnMoves(movetext):
+    # strips comments, variations, NAGs, move numbers and the result
+    movetext = re.sub(r"\{[^}]*\}|;[^\n]*", " ", movetext)
+    while "(" in movetext:
+        stripped = re.sub(r"\([^()]*\)", " ", movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    moves = []
+    for token in movetext.split():
+        token = re.sub(r"^\d+\.+", "", token)
+        if token and not token.startswith("$") and token not in RESULTS:
+            moves.append(token)
+    return moves
+
+
+def buildBook(games, path, maxPlies=BOOK_PLIES):
+    # compiles move lists into a book file, a move's weight is the number
+    # of games that played it. Returns the entry count.
+    counts = {}
+    for moves in games:
+        gs = ChessEngine.GameState()
+        for text in moves[:maxPlies]:
+            move = parseMove(gs, text)
+            if move is None:
+                break
+            entry = (gs.zobristKey, encodeMove(move))
+            counts[entry] = counts.get(entry, 0) + 1
+            gs.makeMove(move)
+    entries = sorted(((key, code, min(weight, MAX_WEIGHT))
+                      for (key, code), weight in counts.items()),
+                     key=lambda entry: (entry[0], -entry[2], entry[1]))
+    with open(path, "wb") as file:
+        for key, code, weight in entries:
+            file.write(ENTRY.pack(key, code, weight, 0))
+    return len(entries)
+
+
+class OpeningBook():
+    # reads a book file through a read only memory map, entries are only
+    # unpacked while searching so the file never gets loaded into the heap
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // ENTRY.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def entries(self, key):
+        # [(move code, weight)] of the position with this key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle*ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            entryKey, code, weight, learn = ENTRY.unpack_from(self.data, low*ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((code, weight))
+            low += 1
+        return found
+
+    def chooseMove(self, gs, rng=random):
+        # a legal book move of gs picked at random by weight, or None
+        moves = []
+        weights = []
+        for code, weight in self.entries(gs.zobristKey):
+            move = decodeMove(gs, code)
+            if move is not None and weight > 0:
+                moves.append((move, move.promotionChoice))
+                weights.append(weight)
+        if not moves:
+            return None
+        move, promotionChoice = rng.choices(moves, weights)[0]
+        move.promotionChoice = promotionChoice
+        return move
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    parser.add_argument("book", help="book file to write or read")
+    parser.add_argument("--build", nargs="+", metavar="GAMES",
+                        help=".pgn files or move lists, one game per line")
+    parser.add_argument("--plies", type=int, default=BOOK_PLIES,
+                        help="moves per game that go into the book")
+    parser.add_argument("--moves", default="",
+                        help="print the book moves after these moves")
+    args = parser.parse_args()
+
+    if args.build:
+        games = (moves for path in args.build for moves in readGames(path))
+        print(buildBook(games, args.book, args.plies), "entries")
+        return 0
+    gs = ChessEngine.GameState()
+    for text in args.moves.split():
+        move = parseMove(gs, text)
+        if move is None:
+            print("illegal move", text)
+            return 1
+        gs.makeMove(move)
+    book = OpeningBook(args.book)
+    validMoves = gs.getValidMove()
+    for code, weight in book.entries(gs.zobristKey):
+        move = decodeMove(gs, code)
+        if move is not None:
+            print(sanMove(move, validMoves), weight)
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
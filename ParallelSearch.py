@@ -0,0 +1,178 @@
+import argparse
+import concurrent.futures
+import os
+import time
+import ChessEngine
+import ChessAI
+
+# Root splitting over a process pool. The first (best ordered) root move is
+# searched with the full window, then every other root move goes to a worker
+# with a null window around the best score so far, and only moves that beat
+# it are searched again with an open window. Every worker process keeps its
+# own transposition table and gets its own copy of the game state with each
+# task, so nothing is shared but the results.
+SEARCH_WORKERS = os.cpu_count() or 1
+BENCH_FENS = (
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+)
+
+
+def searchMove(gs, moveID, depth, alpha, beta, deadline=None):
+    # runs in a worker: score of the root move moveID at depth from the side
+    # to move in gs, as (moveID, score, pv, nodes, stopped)
+    tt = ChessAI.transpositionTable
+    timeLimit = None if deadline is None else max(0.0, deadline - time.time())
+    control = ChessAI.SearchControl(timeLimit)
+    control.rootPly = len(gs.zobristLog)
+    # the full legal list, getMoveByID leaves castling out
+    for move in gs.getValidMove():
+        if move.moveID == moveID:
+            break
+    else:
+        raise ValueError("move %d is not legal in %s" % (moveID, gs.getFen()))
+    if move.isPawnPromotion:
+        move.promotionChoice = 'Q'
+    gs.makeMove(move)
+    score = -ChessAI.minimaxalphabeta(gs, -beta, -alpha, depth-1, tt, control)
+    pv = [move] + ChessAI.principalVariation(gs, tt, depth-1)
+    gs.undoMove()
+    return moveID, score, pv, control.nodes, control.stopped
+
+
+def startWorker():
+    # empty task, makes the pool spawn a worker process
+    return os.getpid()
+
+
+def parallelSearch(gs, depth, executor, deadline=None, firstMoveID=None):
+    # (best move, score, pv, nodes) of gs at depth, the move is None if the
+    # deadline (time.time() seconds) passed before the search finished
+    moves = gs.getValidMove()
+    ChessAI.orderMoves(moves, firstMoveID)
+    byID = {move.moveID: move for move in moves}
+    nodes = 0
+
+    first = executor.submit(searchMove, gs, moves[0].moveID, depth,
+                            -100000, 100000, deadline)
+    moveID, alpha, pv, count, stopped = first.result()
+    nodes += count
+    if stopped:
+        return None, alpha, pv, nodes
+    bestMoveID = moveID
+    pending = {executor.submit(searchMove, gs, move.moveID, depth,
+                               alpha, alpha+1, deadline): alpha
+               for move in moves[1:]}
+    while pending:
+        done, rest = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            window = pending.pop(future)
+            moveID, score, movePv, count, stopped = future.result()
+            nodes += count
+            if stopped:
+                for future in pending:
+                    future.cancel()
+                return None, alpha, pv, nodes
+            if window is None:
+                # full window re-search of a move that beat alpha
+                if score > alpha:
+                    alpha, bestMoveID, pv = score, moveID, movePv
+            elif score > window:
+                # failing high only bounds the score from below, so search
+                # it again from the current alpha even if a re-search of
+                # another move has raised alpha past that bound
+                pending[executor.submit(searchMove, gs, moveID, depth,
+                                        alpha, 100000, deadline)] = None
+    return byID[bestMoveID], alpha, pv, nodes
+
+
+def aimoveParallel(gs, timeLimit=None, maxDepth=ChessAI.MAX_SEARCH_DEPTH, workers=None, executor=None):
+    # iterative deepening over parallelSearch, returns (best move, score,
+    # pv, nodes) of the last completed depth. Pass an executor to keep the
+    # workers and their tables alive between moves.
+    moves = gs.getValidMove()
+    if len(moves) <= 1:
+        return (moves[0] if moves else None), 0, moves[:1], 0
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = concurrent.futures.ProcessPoolExecutor(workers or SEARCH_WORKERS)
+    deadline = None if timeLimit is None else time.time() + timeLimit
+    best = (None, 0, [], 0)
+    nodes = 0
+    try:
+        for depth in range(1, maxDepth+1):
+            firstMoveID = best[0].moveID if best[0] else None
+            move, score, pv, count = parallelSearch(gs, depth, executor,
+                                                    deadline, firstMoveID)
+            nodes += count
+            if move is None:
+                break
+            best = (move, score, pv, nodes)
+            if abs(score) > ChessAI.MATE_THRESHOLD:
+                break
+    finally:
+        if ownExecutor:
+            executor.shutdown(cancel_futures=True)
+    if best[0] is None:
+        ChessAI.orderMoves(moves)
+        best = (moves[0], 0, moves[:1], nodes)
+    return best
+
+
+def benchmark(depth, workerCounts, fens=BENCH_FENS):
+    # fixed depth search of every fen with each worker count, prints time,
+    # nodes per second and the speed-up over the first count
+    baseline = None
+    for workers in workerCounts:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            # start the processes before the clock runs
+            for future in [executor.submit(startWorker) for i in range(workers)]:
+                future.result()
+            nodes = 0
+            start = time.perf_counter()
+            for fen in fens:
+                gs = ChessEngine.GameState()
+                gs.loadFen(fen)
+                nodes += parallelSearch(gs, depth, executor)[3]
+            elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = elapsed
+        print("%2d workers: %8d nodes in %7.3fs (%d nodes/sec) speed-up %.2fx" % (
+            workers, nodes, elapsed, nodes / elapsed, baseline / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel root search")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--fen", default=None,
+                        help="position to search, defaults to the start")
+    parser.add_argument("--workers", type=int, default=SEARCH_WORKERS)
+    parser.add_argument("--bench", action="store_true",
+                        help="time the benchmark positions with 1, 2, 4... workers")
+    args = parser.parse_args()
+
+    if args.bench:
+        counts = [1]
+        while counts[-1]*2 <= args.workers:
+            counts.append(counts[-1]*2)
+        if counts[-1] != args.workers:
+            counts.append(args.workers)
+        benchmark(args.depth, counts)
+        return 0
+    gs = ChessEngine.GameState()
+    if args.fen:
+        gs.loadFen(args.fen)
+    start = time.perf_counter()
+    move, score, pv, nodes = aimoveParallel(gs, maxDepth=args.depth,
+                                            workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print("bestmove %s score %d pv %s" % (move.getChessNotation(), score,
+                                          " ".join(m.getChessNotation() for m in pv)))
+    print("%d nodes in %.3fs (%d nodes/sec)" % (nodes, elapsed, nodes / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+import argparse
+import time
+import ChessEngine
+import BitboardEngine
+import Epd
+
+# perft counts the leaf nodes of the legal move tree, the numbers below are
+# the published reference counts for these positions
+STARTPOS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+POSITIONS = [
+    ("startpos", STARTPOS,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+BACKENDS = {"mailbox": ChessEngine.GameState,
+            "bitboard": BitboardEngine.BitboardGameState}
+PROMOTIONS = ("Q", "R", "B", "N")
+
+
+def newGameState(fen, backend="mailbox", reference=False):
+    gs = BACKENDS[backend]()
+    gs.loadFen(fen)
+    if reference:
+        gs.moveGenMode = "reference"
+    return gs
+
+
+def expandPromotions(move):
+    # getValidMove returns one move per promotion square, perft has to count
+    # every piece it can promote to
+    if move.isPawnPromotion:
+        return PROMOTIONS
+    return (move.promotionChoice,)
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMove()
+    nodes = 0
+    for move in moves:
+        for choice in expandPromotions(move):
+            if depth == 1:
+                nodes += 1
+                continue
+            move.promotionChoice = choice
+            gs.makeMove(move)
+            nodes += perft(gs, depth-1)
+            gs.undoMove()
+        move.promotionChoice = "Q"
+    return nodes
+
+
+def divide(gs, depth):
+    # node count below every root move, keyed by its notation
+    results = []
+    for move in gs.getValidMove():
+        for choice in expandPromotions(move):
+            move.promotionChoice = choice
+            name = move.getChessNotation()
+            if move.isPawnPromotion:
+                name += choice.lower()
+            gs.makeMove(move)
+            results.append((name, perft(gs, depth-1)))
+            gs.undoMove()
+        move.promotionChoice = "Q"
+    return results
+
+
+def timedPerft(gs, depth, showDivide=False):
+    start = time.perf_counter()
+    if showDivide:
+        results = divide(gs, depth)
+        for name, count in results:
+            print(name + ": " + str(count))
+        nodes = sum(count for name, count in results)
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def report(label, depth, nodes, elapsed, expected=None):
+    nps = int(nodes / elapsed) if elapsed > 0 else 0
+    line = "%s depth %d: %d nodes in %.3fs (%d nodes/sec)" % (
+        label, depth, nodes, elapsed, nps)
+    if expected is not None:
+        line += " OK" if nodes == expected else " FAIL expected %d" % expected
+    print(line)
+
+
+def epdPositions(path):
+    # (name, fen, counts) of a perft EPD file, counts from "D1 20; D2 400;"
+    for number, (fen, operations) in enumerate(Epd.readEpd(path)):
+        counts = {int(opcode[1:]): int(operand) for opcode, operand in operations.items()
+                  if opcode[0] == "D" and opcode[1:].isdigit()}
+        yield operations.get("id", "epd%d" % (number + 1)), fen, counts
+
+
+def runSuite(maxDepth, backend="mailbox", reference=False, positions=POSITIONS):
+    # every reference position up to maxDepth, returns False on a mismatch
+    passed = True
+    for name, fen, counts in positions:
+        for depth in sorted(counts):
+            if depth > maxDepth:
+                break
+            gs = newGameState(fen, backend, reference)
+            nodes, elapsed = timedPerft(gs, depth)
+            report(name, depth, nodes, elapsed, counts[depth])
+            passed = passed and nodes == counts[depth]
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count perft leaf nodes")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--fen", default=None,
+                        help="position to search, defaults to the start")
+    parser.add_argument("--position", default=None,
+                        choices=[name for name, fen, counts in POSITIONS],
+                        help="one of the built in reference positions")
+    parser.add_argument("--divide", action="store_true",
+                        help="print the node count below every root move")
+    parser.add_argument("--suite", action="store_true",
+                        help="check all reference positions up to depth")
+    parser.add_argument("--epd", default=None,
+                        help="check the positions of a perft EPD file (D1 20; D2 400;) up to depth")
+    parser.add_argument("--backend", default="mailbox",
+                        choices=sorted(BACKENDS))
+    parser.add_argument("--reference", action="store_true",
+                        help="use the make/undo reference move generator")
+    args = parser.parse_args()
+    if args.reference and args.backend != "mailbox":
+        # only GameState has the make/undo generator, bitboards always
+        # generate legal moves directly
+        parser.error("--reference needs --backend mailbox")
+
+    if args.suite:
+        return 0 if runSuite(args.depth, args.backend, args.reference) else 1
+    if args.epd:
+        passed = runSuite(args.depth, args.backend, args.reference, epdPositions(args.epd))
+        return 0 if passed else 1
+    fen = args.fen or STARTPOS
+    expected = None
+    if args.position is not None:
+        for name, positionFen, counts in POSITIONS:
+            if name == args.position:
+                fen = positionFen
+                expected = counts.get(args.depth)
+    gs = newGameState(fen, args.backend, args.reference)
+    nodes, elapsed = timedPerft(gs, args.depth, args.divide)
+    report(args.position or "perft", args.depth, nodes, elapsed, expected)
+    return 0 if expected is None or nodes == expected else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
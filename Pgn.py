@@ -0,0 +1,226 @@
+import argparse
+import copy
+import re
+import time
+import ChessEngine
+import OpeningBook
+
+# PGN import and export. readPgn streams a file a line at a time and holds
+# one game at a time, so databases of any size read in constant memory.
+# replayPositions plays every game through a game state, resolving SAN
+# with the fast path of OpeningBook.parseMove. gameRecord and writePgn
+# export a game from its moveLog. A game is (tags, moves): a dict of tag
+# pairs and the SAN strings of the main line, tags["Result"] always set.
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+TAG_ROSTER = (("Event", "?"), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"),
+              ("White", "?"), ("Black", "?"), ("Result", "*"))
+TAG = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+LINE_LENGTH = 79
+
+
+def stripComments(line, inComment):
+    # (text of line outside {} and ; comments, whether a {} comment is
+    # still open at the end of the line)
+    text = []
+    for ch in line:
+        if inComment:
+            if ch == "}":
+                inComment = False
+        elif ch == "{":
+            inComment = True
+        elif ch == ";":
+            break
+        else:
+            text.append(ch)
+    return "".join(text), inComment
+
+
+def readPgn(path):
+    # yields the (tags, moves) games of a PGN file
+    with open(path, errors="replace") as file:
+        yield from parsePgn(file)
+
+
+def parsePgn(lines):
+    # yields the games of any iterable of PGN lines. A game ends at its
+    # result, or where the tags of the next one start.
+    tags = {}
+    movetext = []
+    inComment = False
+    variations = 0
+    for line in lines:
+        if not inComment and variations == 0:
+            if line.startswith("%"):
+                continue
+            match = TAG.match(line)
+            if match is not None:
+                if movetext:
+                    yield finishGame(tags, movetext)
+                    tags, movetext = {}, []
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        text, inComment = stripComments(line, inComment)
+        variations = max(0, variations + text.count("(") - text.count(")"))
+        tokens = text.split()
+        if not tokens:
+            continue
+        movetext.append(text)
+        if variations == 0 and not inComment and tokens[-1] in OpeningBook.RESULTS:
+            yield finishGame(tags, movetext)
+            tags, movetext = {}, []
+    if tags or movetext:
+        yield finishGame(tags, movetext)
+
+
+def finishGame(tags, movetext):
+    tokens = " ".join(movetext).split()
+    if tokens and tokens[-1] in OpeningBook.RESULTS:
+        tags["Result"] = tokens[-1]
+    tags.setdefault("Result", "*")
+    return tags, OpeningBook.pgnMoves(" ".join(movetext))
+
+
+def replayGame(tags, moves, gameState=ChessEngine.GameState):
+    # yields (gs, move) for every move of the game before it is played. The
+    # one game state is played on between steps, copy whatever has to
+    # outlive a step. Stops at the first move that is not legal.
+    gs = gameState()
+    if "FEN" in tags:
+        gs.loadFen(tags["FEN"])
+    for text in moves:
+        move = OpeningBook.parseMove(gs, text)
+        if move is None:
+            return
+        yield gs, move
+        gs.makeMove(move)
+
+
+def replayPositions(path, gameState=ChessEngine.GameState):
+    # (gs, move) of every move of every game in a PGN file
+    for tags, moves in readPgn(path):
+        yield from replayGame(tags, moves, gameState)
+
+
+def gameResult(gs):
+    # result of the position gs stands in, "*" while the game goes on
+    gs.getValidMove()
+    if gs.checkMate:
+        return "0-1" if gs.whiteToMove else "1-0"
+    if gs.staleMate or gs.halfmoveClock >= 100:
+        return "1/2-1/2"
+    return "*"
+
+
+def gameRecord(gs, tags=None, result=None):
+    # (tags, moves) of the game played on gs, from its moveLog. gs itself is
+    # left alone, a copy is taken back to the start and played forward.
+    # The result is read off the final position unless given.
+    replay = copy.deepcopy(gs)
+    moves = list(replay.moveLog)
+    for move in moves:
+        replay.undoMove()
+    tags = dict(tags or {})
+    fen = replay.getFen()
+    if fen != START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = fen
+    san = []
+    for move in moves:
+        text = OpeningBook.sanMove(move, replay.getValidMove())
+        replay.makeMove(move)
+        if replay.inCheck():
+            text += "#" if not replay.getValidMove() else "+"
+        san.append(text)
+    tags["Result"] = result or gameResult(replay)
+    return tags, san
+
+
+def pgnText(tags, moves):
+    # PGN of one game: the seven tag roster first, then the other tags and
+    # the movetext wrapped at LINE_LENGTH
+    lines = []
+    for name, default in TAG_ROSTER:
+        lines.append('[%s "%s"]' % (name, escapeTag(tags.get(name, default))))
+    for name, value in tags.items():
+        if name not in dict(TAG_ROSTER):
+            lines.append('[%s "%s"]' % (name, escapeTag(value)))
+    lines.append("")
+    fields = tags.get("FEN", START_FEN).split()
+    whiteToMove = fields[1] == "w"
+    number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for i, move in enumerate(moves):
+        if whiteToMove:
+            tokens.append("%d." % number)
+        elif i == 0:
+            tokens.append("%d..." % number)
+        tokens.append(move)
+        if not whiteToMove:
+            number += 1
+        whiteToMove = not whiteToMove
+    tokens.append(tags.get("Result", "*"))
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def escapeTag(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def writePgn(path, games, append=False):
+    # writes (tags, moves) games, blank line between games, returns the count
+    count = 0
+    with open(path, "a" if append else "w") as file:
+        for tags, moves in games:
+            file.write(pgnText(tags, moves) + "\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read, check and rewrite PGN files")
+    parser.add_argument("pgn", help="PGN file to replay")
+    parser.add_argument("--out", default=None, help="write the games that replayed cleanly here")
+    parser.add_argument("--bitboard", action="store_true", help="replay on BitboardGameState")
+    args = parser.parse_args()
+
+    gameState = ChessEngine.GameState
+    if args.bitboard:
+        import BitboardEngine
+        gameState = BitboardEngine.BitboardGameState
+    counts = {"games": 0, "moves": 0, "broken": 0}
+
+    def replayed():
+        # the games that replay cleanly, streamed to the writer
+        for tags, moves in readPgn(args.pgn):
+            played = sum(1 for step in replayGame(tags, moves, gameState))
+            counts["games"] += 1
+            counts["moves"] += played
+            if played < len(moves):
+                counts["broken"] += 1
+                print("game %d: illegal move %s after %d plies" % (counts["games"], moves[played], played))
+            else:
+                yield tags, moves
+
+    start = time.perf_counter()
+    if args.out:
+        writePgn(args.out, replayed())
+    else:
+        for game in replayed():
+            pass
+    elapsed = time.perf_counter() - start
+    print("%d games, %d moves, %d broken in %.2fs (%.0f moves/s)" % (
+        counts["games"], counts["moves"], counts["broken"], elapsed,
+        counts["moves"] / elapsed if elapsed > 0 else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,171 @@
+import argparse
+import json
+import time
+
+# Statistics of one search: node counts and speed, depth and selective
+# depth, how often the first move searched already cut off, the effective
+# branching factor, transposition table hits, the time split between move
+# generation, evaluation and make/undo, and the principal variation of
+# every completed depth. The search only touches an instance behind an
+# "is not None" check, so with ChessAI.SEARCH_STATS off none of this runs.
+# Timing swaps instance attributes over the game state's own methods for
+# the length of the search, calls made from inside a timed call are
+# counted once, in the outer one.
+MOVEGEN_METHODS = ("getValidMove", "getCaptureMoves", "getQuietMoves", "getMoveByID",
+                   "isLegalMove", "inCheck")
+MAKE_METHODS = ("makeMove", "undoMove", "makeNullMove", "undoNullMove")
+
+
+class SearchStats():
+    def __init__(self):
+        self.seldepth = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.iterations = []  # (depth, score, nodes of that depth, seconds, pv) per completed depth
+        self.iterationStart = 0  # control.nodes when the current depth started
+        self.times = {"movegen": 0.0, "eval": 0.0, "makeundo": 0.0}
+        self.timing = False  # inside a timed call
+        self.tableStart = None
+        self.record = None  # the summary once finish ran
+
+    def attach(self, gs, tt=None):
+        for name in MOVEGEN_METHODS:
+            setattr(gs, name, self.timed("movegen", getattr(gs, name)))
+        for name in MAKE_METHODS:
+            setattr(gs, name, self.timed("makeundo", getattr(gs, name)))
+        if tt is not None:
+            self.tableStart = (tt.probes, tt.hits, tt.stores, tt.collisions)
+
+    def detach(self, gs):
+        for name in MOVEGEN_METHODS + MAKE_METHODS:
+            gs.__dict__.pop(name, None)
+
+    def timed(self, kind, function):
+        def wrapper(*args):
+            if self.timing:
+                return function(*args)
+            self.timing = True
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.times[kind] += time.perf_counter() - start
+                self.timing = False
+        return wrapper
+
+    def measure(self, kind, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.times[kind] += time.perf_counter() - start
+        return result
+
+    def reach(self, ply):
+        if ply > self.seldepth:
+            self.seldepth = ply
+
+    def cutoff(self, moveCount):
+        self.cutoffs += 1
+        if moveCount == 1:
+            self.firstMoveCutoffs += 1
+
+    def iteration(self, control, depth, score, pv):
+        nodes = control.nodes - self.iterationStart
+        self.iterationStart = control.nodes
+        self.iterations.append((depth, score, nodes,
+                                time.perf_counter() - control.startTime,
+                                [uciMove(move) for move in pv]))
+
+    def branchingFactor(self):
+        # nodes searched for the last completed depth over those searched for
+        # the one before, each iteration counted on its own
+        if len(self.iterations) < 2 or self.iterations[-2][2] == 0:
+            return None
+        return self.iterations[-1][2] / self.iterations[-2][2]
+
+    def finish(self, control, tt=None, move=None):
+        # fills record, the JSON ready summary of the search
+        elapsed = time.perf_counter() - control.startTime
+        searched = sum(self.times.values())
+        record = {
+            "time": time.time(),
+            "move": uciMove(move) if move is not None else None,
+            "depth": control.completedDepth,
+            "seldepth": self.seldepth,
+            "score": self.iterations[-1][1] if self.iterations else None,
+            "nodes": control.nodes,
+            "qnodes": control.qnodes,
+            "nps": round(control.nodes / elapsed) if elapsed > 0 else 0,
+            "elapsed": round(elapsed, 4),
+            "cutoffs": self.cutoffs,
+            "firstMoveCutoffRate": round(self.firstMoveCutoffs / self.cutoffs, 4) if self.cutoffs else None,
+            "branchingFactor": round(self.branchingFactor(), 3) if self.branchingFactor() else None,
+            "seconds": {kind: round(seconds, 4) for kind, seconds in self.times.items()},
+            "pv": self.iterations[-1][4] if self.iterations else [],
+            "iterations": [{"depth": depth, "score": score, "nodes": nodes, "elapsed": round(seconds, 4)}
+                           for depth, score, nodes, seconds, pv in self.iterations],
+        }
+        record["seconds"]["other"] = round(max(0.0, elapsed - searched), 4)
+        if tt is not None and self.tableStart is not None:
+            probes, hits, stores, collisions = (now - start for now, start in zip(
+                (tt.probes, tt.hits, tt.stores, tt.collisions), self.tableStart))
+            record["tt"] = {"probes": probes, "hits": hits, "stores": stores, "collisions": collisions,
+                            "hitRate": round(hits / probes, 4) if probes else None}
+        self.record = record
+        return record
+
+
+def uciMove(move):
+    text = move.getChessNotation()
+    if move.isPawnPromotion:
+        text += move.promotionChoice.lower()
+    return text
+
+
+def writeJsonLine(path, record):
+    # appends record to a JSON lines file
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def readJsonLines(path):
+    # yields the records of a JSON lines file
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summary(records):
+    # averages over search records, None where no record has the value
+    records = list(records)
+    totals = {}
+    for key in ("nps", "depth", "seldepth", "firstMoveCutoffRate", "branchingFactor"):
+        values = [record[key] for record in records if record.get(key) is not None]
+        totals[key] = sum(values) / len(values) if values else None
+    seconds = {}
+    for record in records:
+        for kind, spent in record["seconds"].items():
+            seconds[kind] = seconds.get(kind, 0.0) + spent
+    elapsed = sum(seconds.values())
+    totals["timeShare"] = {kind: spent / elapsed for kind, spent in seconds.items()} if elapsed else {}
+    totals["searches"] = len(records)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise search statistics")
+    parser.add_argument("stats", help="JSON lines file written with ChessAI.STATS_FILE")
+    args = parser.parse_args()
+
+    totals = summary(readJsonLines(args.stats))
+    print("searches", totals["searches"])
+    for key in ("nps", "depth", "seldepth", "firstMoveCutoffRate", "branchingFactor"):
+        if totals[key] is not None:
+            print("%-20s %.2f" % (key, totals[key]))
+    for kind, share in totals["timeShare"].items():
+        print("%-20s %.1f%%" % ("time " + kind, share * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
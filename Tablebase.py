@@ -0,0 +1,222 @@
+import argparse
+import os
+import time
+import ChessEngine
+
+# Endgame tablebases for a lone king against king and one piece (KQK, KRK,
+# also KBK and KNK which come out as all draws). One byte per position from
+# the side to move's view: 0 is a draw (or an impossible position), any
+# other value is the number of plies to mate plus one, odd when the side to
+# move is mated (1 means mated now) and even when it mates.
+#
+# Positions are indexed with the strong side as white, the strong king on
+# files a-d (the board is mirrored left to right otherwise, without pawns
+# or castling that changes nothing) and the side to move:
+# index = ((toMove*32 + strongKing)*64 + weakKing)*64 + piece, squares as
+# row*8 + col and the strong king square as row*4 + col.
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+PIECE_SETS = ("KQK", "KRK", "KBK", "KNK")
+STRONG_TO_MOVE = 0
+WEAK_TO_MOVE = 1
+TABLE_SIZE = 2*32*64*64
+DRAW = 0
+
+
+def tableIndex(toMove, strongKing, weakKing, piece):
+    # squares as row*8 + col, mirrored so the strong king is on files a-d
+    if strongKing % 8 >= 4:
+        strongKing ^= 7
+        weakKing ^= 7
+        piece ^= 7
+    return ((toMove*32 + (strongKing // 8)*4 + strongKing % 8)*64 + weakKing)*64 + piece
+
+
+def positionFen(pieceType, toMove, strongKing, weakKing, piece):
+    # FEN of an indexed position, the strong side is white
+    board = [["--"]*8 for row in range(8)]
+    board[strongKing // 8][strongKing % 8] = "wK"
+    board[weakKing // 8][weakKing % 8] = "bK"
+    board[piece // 8][piece % 8] = "w" + pieceType
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for square in row:
+            if square == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += square[1] if square[0] == "w" else square[1].lower()
+        ranks.append(rank + (str(empty) if empty else ""))
+    return "/".join(ranks) + (" w" if toMove == STRONG_TO_MOVE else " b") + " - - 0 1"
+
+
+def generate(pieceSet, log=None):
+    # solves pieceSet ("KQK") by retrograde analysis, returns the table as
+    # a bytearray. Every legal position is set up on a GameState once to
+    # list its successors, then results spread backwards from the mates:
+    # a position with a move to a lost one is won, a position whose moves
+    # all lead to won ones is lost, in order of distance to mate.
+    pieceType = pieceSet[1]
+    gs = ChessEngine.GameState()
+    successors = {}
+    lost = []
+    for toMove in (STRONG_TO_MOVE, WEAK_TO_MOVE):
+        for strongKing in range(64):
+            if strongKing % 8 >= 4:
+                continue
+            for weakKing in range(64):
+                if abs(strongKing // 8 - weakKing // 8) <= 1 and abs(strongKing % 8 - weakKing % 8) <= 1:
+                    continue
+                for piece in range(64):
+                    if piece == strongKing or piece == weakKing:
+                        continue
+                    gs.loadFen(positionFen(pieceType, toMove, strongKing, weakKing, piece))
+                    # the side that just moved may not be left in check
+                    if toMove == STRONG_TO_MOVE and gs.squareAttackedBy(weakKing // 8, weakKing % 8, "w"):
+                        continue
+                    index = tableIndex(toMove, strongKing, weakKing, piece)
+                    moves = gs.getValidMove()
+                    if not moves:
+                        if gs.checkMate:
+                            lost.append(index)
+                        successors[index] = []
+                        continue
+                    children = []
+                    for move in moves:
+                        if move.pieceCaptured != "--":
+                            children.append(None)  # bare kings, a draw
+                            continue
+                        squares = [strongKing, weakKing, piece]
+                        moved = {"wK": 0, "bK": 1}.get(move.pieceMoved, 2)
+                        squares[moved] = move.endRow*8 + move.endCol
+                        children.append(tableIndex(1 - toMove, *squares))
+                    successors[index] = children
+        if log is not None:
+            log("%s: listed %s to move" % (pieceSet, "strong" if toMove == STRONG_TO_MOVE else "weak"))
+
+    predecessors = {}
+    remaining = {}
+    for index, children in successors.items():
+        remaining[index] = len(children)
+        for child in children:
+            if child is not None:
+                predecessors.setdefault(child, []).append(index)
+
+    table = bytearray(TABLE_SIZE)
+    for index in lost:
+        table[index] = 1
+    frontier = lost
+    plies = 0
+    while frontier:
+        plies += 1
+        nextFrontier = []
+        for index in frontier:
+            childLost = table[index] % 2 == 1
+            for parent in predecessors.get(index, ()):
+                if table[parent] != DRAW:
+                    continue
+                if childLost:
+                    table[parent] = plies + 1
+                    nextFrontier.append(parent)
+                else:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0:
+                        table[parent] = plies + 1
+                        nextFrontier.append(parent)
+        frontier = nextFrontier
+    return table
+
+
+def tablePath(pieceSet, directory=TABLEBASE_DIR):
+    return os.path.join(directory, pieceSet + ".tb")
+
+
+class Tablebases():
+    # the tables found in directory, held in memory (256 KB each). probe
+    # answers in constant time for positions with at most maxPieces pieces.
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.tables = {}
+        for pieceSet in PIECE_SETS:
+            path = tablePath(pieceSet, directory)
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    data = file.read()
+                if len(data) == TABLE_SIZE:
+                    self.tables[pieceSet[1]] = data
+        self.maxPieces = 3 if self.tables else 0
+
+    def probe(self, gs):
+        # (value, plies) of gs from the side to move's view, value 1 for a
+        # win, 0 for a draw and -1 for a loss, or None if no table covers gs
+        kings = {}
+        piece = None
+        board = gs.board
+        for row in range(8):
+            for col in range(8):
+                square = board[row][col]
+                if square == "--":
+                    continue
+                if square[1] == "K":
+                    kings[square[0]] = row*8 + col
+                elif piece is not None:
+                    return None
+                else:
+                    piece = square, row*8 + col
+        if piece is None:
+            return (0, 0) if len(kings) == 2 else None
+        table = self.tables.get(piece[0][1])
+        if table is None:
+            return None
+        strongColor = piece[0][0]
+        strongKing = kings[strongColor]
+        weakKing = kings["b" if strongColor == "w" else "w"]
+        pieceSquare = piece[1]
+        if strongColor == "b":
+            # colours swapped, the board flipped top to bottom
+            strongKing ^= 56
+            weakKing ^= 56
+            pieceSquare ^= 56
+        strongToMove = gs.whiteToMove == (strongColor == "w")
+        entry = table[tableIndex(STRONG_TO_MOVE if strongToMove else WEAK_TO_MOVE,
+                                 strongKing, weakKing, pieceSquare)]
+        if entry == DRAW:
+            return 0, 0
+        return (-1 if entry % 2 == 1 else 1), entry - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    parser.add_argument("--generate", nargs="*", metavar="SET", choices=PIECE_SETS,
+                        help="piece sets to solve, all of them if none given")
+    parser.add_argument("--dir", default=TABLEBASE_DIR)
+    parser.add_argument("--probe", metavar="FEN", help="look a position up")
+    args = parser.parse_args()
+
+    if args.generate is not None:
+        os.makedirs(args.dir, exist_ok=True)
+        for pieceSet in args.generate or PIECE_SETS:
+            start = time.perf_counter()
+            table = generate(pieceSet, print)
+            with open(tablePath(pieceSet, args.dir), "wb") as file:
+                file.write(table)
+            longest = max(table)
+            print("%s: longest mate %d plies, %.1fs" % (
+                pieceSet, longest - 1 if longest else 0, time.perf_counter() - start))
+    if args.probe:
+        gs = ChessEngine.GameState()
+        gs.loadFen(args.probe)
+        result = Tablebases(args.dir).probe(gs)
+        if result is None:
+            print("not in the tablebases")
+        else:
+            value, plies = result
+            print({1: "win", 0: "draw", -1: "loss"}[value],
+                  "" if value == 0 else "mate in %d plies" % plies)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
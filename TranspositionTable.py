@@ -0,0 +1,70 @@
+# bound types of a stored score
+EXACT = 0
+LOWERBOUND = 1  # the search failed high, the real score is at least this
+UPPERBOUND = 2  # the search failed low, the real score is at most this
+
+# rough size of one slot in CPython: the entry tuple, its ints and the list
+# pointer. Only used to turn a memory budget into a slot count.
+ENTRY_BYTES = 160
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        # the slot count is a power of two so the index is a mask of the key
+        slots = max(1, sizeMB * 1024 * 1024 // ENTRY_BYTES)
+        self.size = 1 << (slots.bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.collisions = 0  # probe or store found another position's entry
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.resetStats()
+
+    def newSearch(self):
+        # entries of earlier searches are replaced before deeper current ones
+        self.generation += 1
+
+    def probe(self, key):
+        # (depth, score, bound, bestMoveID) or None
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is None:
+            return None
+        if entry[0] != key:
+            self.collisions += 1
+            return None
+        self.hits += 1
+        return entry[1], entry[2], entry[3], entry[4]
+
+    def store(self, key, depth, score, bound, bestMoveID):
+        # depth preferred replacement, entries from older searches always go
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None and entry[0] != key:
+            self.collisions += 1
+            if entry[5] == self.generation and entry[1] > depth:
+                return
+        elif entry is not None and entry[5] == self.generation and entry[1] > depth and bound != EXACT:
+            return
+        self.stores += 1
+        self.entries[index] = (key, depth, score, bound,
+                               bestMoveID, self.generation)
+
+    def usage(self):
+        # share of slots filled, sampled from the first thousand
+        sample = self.entries[:1000]
+        return sum(1 for entry in sample if entry is not None) / len(sample)
+
+    def stats(self):
+        return {"size": self.size, "probes": self.probes, "hits": self.hits,
+                "stores": self.stores, "collisions": self.collisions,
+                "usage": self.usage()}
@@ -0,0 +1,203 @@
+import json
+import sys
+import threading
+import time
+import ChessEngine
+import ChessAI
+import OpeningBook
+import SearchStats
+import TranspositionTable
+
+# UCI (universal chess interface) front end over stdin/stdout, no window
+# and no pygame. Searches run as a ChessAI.BackgroundSearch so "stop" and
+# "isready" are answered while the engine thinks.
+ENGINE_NAME = "Chess-AI"
+ENGINE_AUTHOR = "Chess-AI authors"
+GAME_STATE = ChessEngine.GameState
+MOVES_TO_GO = 30  # moves the clock is split over when the GUI does not say
+MIN_MOVE_TIME = 0.05  # seconds
+
+
+def scoreText(score):
+    # mate scores count the plies to mate off MATE_SCORE
+    if abs(score) > ChessAI.MATE_THRESHOLD:
+        moves = (ChessAI.MATE_SCORE - abs(score) + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    return "cp %d" % score
+
+
+def moveTime(gs, options):
+    # seconds to think from the go options: movetime, or a share of the
+    # clock plus most of the increment, None to search without a limit
+    if "movetime" in options:
+        return options["movetime"] / 1000
+    remaining = options.get("wtime" if gs.whiteToMove else "btime")
+    if remaining is None:
+        return None
+    increment = options.get("winc" if gs.whiteToMove else "binc", 0)
+    share = remaining / options.get("movestogo", MOVES_TO_GO) + increment * 0.8
+    return max(MIN_MOVE_TIME, min(share, remaining / 2) / 1000)
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = GAME_STATE()
+        self.search = None
+        self.infinite = False
+        self.pendingMove = None  # an infinite search that finished before stop
+        self.ownBook = True
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        # runs one command, returns False on quit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 1024" % ChessAI.TT_SIZE_MB)
+            self.send("option name OwnBook type check default true")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(tokens[1:])
+        elif command == "ucinewgame":
+            self.stop()
+            ChessAI.transpositionTable.clear()
+        elif command == "position":
+            self.stop()
+            self.position(tokens[1:])
+        elif command == "go":
+            self.stop()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        elif command == "debug":
+            # debug on collects SearchStats, sent as an info string after each search
+            ChessAI.SEARCH_STATS = len(tokens) > 1 and tokens[1] == "on"
+        elif command == "d":
+            self.send(self.gs.getFen())
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def setOption(self, tokens):
+        # setoption name <id> [value <x>]
+        text = " ".join(tokens)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name ", "", 1).strip().lower()
+        value = value.strip()
+        if name == "hash" and value.isdigit():
+            ChessAI.transpositionTable = TranspositionTable.TranspositionTable(max(1, int(value)))
+        elif name == "ownbook":
+            self.ownBook = value.lower() == "true"
+
+    def position(self, tokens):
+        # position startpos|fen <fen> [moves <move>...]
+        if "moves" in tokens:
+            split = tokens.index("moves")
+            setup, moves = tokens[:split], tokens[split+1:]
+        else:
+            setup, moves = tokens, []
+        gs = GAME_STATE()
+        if setup and setup[0] == "fen":
+            try:
+                gs.loadFen(" ".join(setup[1:]))
+            except ValueError:
+                self.send("info string bad fen " + " ".join(setup[1:]))
+                return
+        for text in moves:
+            move = OpeningBook.parseMove(gs, text)
+            if move is None:
+                self.send("info string illegal move " + text)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, tokens):
+        # go [depth n] [movetime ms] [nodes n] [wtime/btime/winc/binc ms]
+        # [movestogo n] [infinite]
+        options = {}
+        for i, token in enumerate(tokens):
+            if token in ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo") and \
+                    i + 1 < len(tokens) and tokens[i+1].lstrip("-").isdigit():
+                options[token] = int(tokens[i+1])
+        self.infinite = "infinite" in tokens
+        self.pendingMove = None
+        timeLimit = None if self.infinite else moveTime(self.gs, options)
+        if not self.ownBook or self.infinite:
+            book = False
+        else:
+            book = None
+        self.search = ChessAI.BackgroundSearch(
+            self.gs, timeLimit, options.get("depth", ChessAI.MAX_SEARCH_DEPTH),
+            progress=self.info, nodeLimit=options.get("nodes"), finished=self.finished,
+            book=book)
+
+    def info(self, depth, score, pv):
+        # called from the search thread, before go has stored the search
+        control = ChessAI.lastSearch
+        nodes = control.nodes
+        elapsed = time.perf_counter() - control.startTime
+        seldepth = ""
+        if control.stats is not None:
+            seldepth = " seldepth %d" % max(depth, control.stats.seldepth)
+        self.send("info depth %d%s score %s nodes %d nps %d time %d pv %s" % (
+            depth, seldepth, scoreText(score), nodes, nodes / elapsed if elapsed > 0 else 0,
+            elapsed * 1000, " ".join(SearchStats.uciMove(move) for move in pv)))
+
+    def finished(self, search):
+        # called from the search thread
+        if self.infinite and not search.control.stopped:
+            self.pendingMove = search
+            return
+        self.bestMove(search)
+
+    def bestMove(self, search):
+        stats = search.control.stats
+        if stats is not None and stats.record is not None:
+            self.send("info string stats " + json.dumps(stats.record))
+        if search.move is None:
+            self.send("bestmove 0000")
+            return
+        line = "bestmove " + SearchStats.uciMove(search.move)
+        reply = search.expectedReply()
+        if reply is not None:
+            line += " ponder " + SearchStats.uciMove(reply)
+        self.send(line)
+
+    def stop(self):
+        # an unfinished search reports its best move as it unwinds, a
+        # finished infinite one was holding it back until now
+        search = self.search
+        if search is None:
+            return
+        search.cancel()
+        if self.pendingMove is search:
+            self.pendingMove = None
+            self.bestMove(search)
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
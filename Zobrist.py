@@ -0,0 +1,45 @@
+import random
+
+# Zobrist keys, one random 64 bit number per piece on every square plus the
+# side to move, each castling right and each en passant file. A position's
+# key is the xor of the numbers for everything in it. The seed is fixed so
+# keys stay the same between runs and processes.
+_random = random.Random(0x5EED)
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_KEYS = {piece: [[_random.getrandbits(64) for col in range(8)] for row in range(8)]
+              for piece in PIECES}
+SIDE_KEY = _random.getrandbits(64)  # xored in when black is to move
+CASTLE_KEYS = {"wks": _random.getrandbits(64), "bks": _random.getrandbits(64),
+               "wqs": _random.getrandbits(64), "bqs": _random.getrandbits(64)}
+ENPASSANT_KEYS = [_random.getrandbits(64) for col in range(8)]
+
+
+def castleKey(rights):
+    key = 0
+    if rights.wks:
+        key ^= CASTLE_KEYS["wks"]
+    if rights.bks:
+        key ^= CASTLE_KEYS["bks"]
+    if rights.wqs:
+        key ^= CASTLE_KEYS["wqs"]
+    if rights.bqs:
+        key ^= CASTLE_KEYS["bqs"]
+    return key
+
+
+def computeHash(gs):
+    # full key of the position in gs, built from scratch
+    key = 0
+    board = gs.board
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][row][col]
+    if not gs.whiteToMove:
+        key ^= SIDE_KEY
+    key ^= castleKey(gs.currentCastlingRights)
+    if gs.enpassantPossible:
+        key ^= ENPASSANT_KEYS[gs.enpassantPossible[1]]
+    return key